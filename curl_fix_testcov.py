@@ -8,8 +8,8 @@
 
 import os
 import subprocess
-import glob
 import csv
+from gcda_utils import iter_gcda_files, purge_gcda_files
 
 # --- HARDCODED CONFIGURATION ---
 PROJECT_NAME = "curl"
@@ -23,6 +23,9 @@ LOG_FILE = os.path.join(RESULTS_DIR, "log", f"{PROJECT_NAME}_{FIX_COMMIT[:8]}.tx
 
 OUTPUT_CSV = os.path.join(RESULTS_DIR, "fix_testcov.csv")
 
+# Parallel make jobs
+CPU_CORES = os.cpu_count() or 1
+
 def ensure_dirs():
     """Create necessary results directories if they don't exist."""
     os.makedirs(os.path.dirname(LOG_FILE), exist_ok=True)
@@ -37,7 +40,7 @@ def run_cmd(command, cwd, description, can_fail=False):
     try:
         subprocess.run(
             command, shell=True, cwd=cwd, check=True,
-            stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True
+            stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True
         )
         return True
     except subprocess.CalledProcessError as e:
@@ -86,15 +89,7 @@ def normalize_gcda_name(filename):
 
 def get_touched_source_files():
     """Finds all .gcda files and maps them to clean .c filenames."""
-    gcda_files = glob.glob(f"{PROJECT_PATH}/**/*.gcda", recursive=True)
-    
-    touched_sources = set()
-    for g in gcda_files:
-        base_name = os.path.basename(g)
-        clean_name = normalize_gcda_name(base_name)
-        touched_sources.add(clean_name)
-        
-    return touched_sources
+    return {normalize_gcda_name(entry.name) for _, entry in iter_gcda_files(PROJECT_PATH, skip_hidden=True)}
 
 def main():
     ensure_dirs()
@@ -121,16 +116,16 @@ def main():
         'CFLAGS="-fprofile-arcs -ftest-coverage -g -O0" LDFLAGS="-fprofile-arcs -ftest-coverage"'
     )
     run_cmd(f"./configure {config_flags}", PROJECT_PATH, "Configure")
-    run_cmd("make -j4", PROJECT_PATH, "Make Main")
+    run_cmd(f"make -j{CPU_CORES}", PROJECT_PATH, "Make Main")
     
     # Build the test suite
-    run_cmd("make", os.path.join(PROJECT_PATH, "tests"), "Make Tests")
+    run_cmd(f"make -j{CPU_CORES}", os.path.join(PROJECT_PATH, "tests"), "Make Tests")
 
     # Get list of all test IDs
     test_data_dir = os.path.join(PROJECT_PATH, "tests/data")
-    test_files = sorted(glob.glob(os.path.join(test_data_dir, "test*")))
-    # Extract just the numbers
-    test_ids = [os.path.basename(t).replace("test", "") for t in test_files if os.path.basename(t).replace("test", "").isdigit()]
+    # Extract just the numbers of the test<N> files; one scandir, no pattern matching
+    with os.scandir(test_data_dir) as it:
+        test_ids = sorted(e.name[4:] for e in it if e.name.startswith("test") and e.name[4:].isdigit())
 
     print(f"🧪 Phase 2: Running {len(test_ids)} tests and checking intersection...")
     
@@ -143,7 +138,7 @@ def main():
 
         for tid in test_ids:
             # 1. Clean previous coverage (Crucial to avoid data leaking between tests)
-            subprocess.run(f"find . -name '*.gcda' -delete", cwd=PROJECT_PATH, shell=True)
+            purge_gcda_files(PROJECT_PATH)
             
             # 2. Run Test using runtests.pl
             # Note: runtests.pl typically passes even if the test logic fails, 
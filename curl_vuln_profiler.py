@@ -82,7 +82,7 @@ def build_commit_clean(commit_hash, log_file):
     )
     run_cmd(config_cmd, PROJECT_PATH, log_file)
     run_cmd(f"make -j{CPU_CORES}", PROJECT_PATH, log_file)
-    run_cmd("make", os.path.join(PROJECT_PATH, "tests"), log_file)
+    run_cmd(f"make -j{CPU_CORES}", os.path.join(PROJECT_PATH, "tests"), log_file)
 
 def calibrate_loops(test_id, log_file):
     write_log(f"⚖️  Calibrating test {test_id}...", log_file)
@@ -139,7 +139,7 @@ def profile_test(test_id, n_loops, log_file):
     for i in range(OUTER_LOOP_COUNT):
         proc = subprocess.run(
             perf_cmd, shell=True, cwd=test_dir, 
-            stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True
+            stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True
         )
         data = parse_perf_output(proc.stderr)
         
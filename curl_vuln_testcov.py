@@ -3,9 +3,9 @@
 
 import os
 import subprocess
-import glob
 import csv
 import multiprocessing
+from gcda_utils import iter_gcda_files, purge_gcda_files
 
 # --- HARDCODED CONFIGURATION ---
 PROJECT_NAME = "curl"
@@ -39,7 +39,7 @@ def run_cmd(command, cwd, description, can_fail=False):
     try:
         subprocess.run(
             command, shell=True, cwd=cwd, check=True,
-            stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True
+            stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True
         )
         return True
     except subprocess.CalledProcessError as e:
@@ -87,15 +87,7 @@ def normalize_gcda_name(filename):
 
 def get_touched_source_files():
     """Finds all .gcda files generated by the last test run and maps them to .c filenames."""
-    gcda_files = glob.glob(f"{PROJECT_PATH}/**/*.gcda", recursive=True)
-    
-    touched_sources = set()
-    for g in gcda_files:
-        base_name = os.path.basename(g)
-        clean_name = normalize_gcda_name(base_name)
-        touched_sources.add(clean_name)
-        
-    return touched_sources
+    return {normalize_gcda_name(entry.name) for _, entry in iter_gcda_files(PROJECT_PATH, skip_hidden=True)}
 
 def main():
     ensure_dirs()
@@ -126,12 +118,13 @@ def main():
     
     # Silent use of all cores
     run_cmd(f"make -j{CPU_CORES}", PROJECT_PATH, "Make Main")
-    run_cmd("make", os.path.join(PROJECT_PATH, "tests"), "Make Tests")
+    run_cmd(f"make -j{CPU_CORES}", os.path.join(PROJECT_PATH, "tests"), "Make Tests")
 
     # 3. Prepare Test List
     test_data_dir = os.path.join(PROJECT_PATH, "tests/data")
-    test_files = sorted(glob.glob(os.path.join(test_data_dir, "test*")))
-    test_ids = [os.path.basename(t).replace("test", "") for t in test_files if os.path.basename(t).replace("test", "").isdigit()]
+    # Test cases are the tests/data/test<N> files; one scandir, no pattern matching
+    with os.scandir(test_data_dir) as it:
+        test_ids = sorted(e.name[4:] for e in it if e.name.startswith("test") and e.name[4:].isdigit())
 
     print(f"🧪 Phase 2: Running {len(test_ids)} tests on VULN commit...")
     
@@ -144,7 +137,7 @@ def main():
 
         for tid in test_ids:
             # A. Clean previous coverage data
-            subprocess.run(f"find . -name '*.gcda' -delete", cwd=PROJECT_PATH, shell=True)
+            purge_gcda_files(PROJECT_PATH)
             
             # B. Run Test
             run_cmd(f"./runtests.pl {tid}", os.path.join(PROJECT_PATH, "tests"), f"Test {tid}", can_fail=True)
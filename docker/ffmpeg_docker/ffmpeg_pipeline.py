@@ -6,6 +6,7 @@ import json
 import time
 import math
 import sys
+import re
 import urllib.request
 
 # ==========================================
@@ -15,6 +16,13 @@ REPO_NAME = "FFmpeg"       # Target project to filter from the Gist CSV
 TARGET_DURATION_SEC = 2.0  # Duration for energy measurement loop
 CSV_WRITE_INTERVAL = 50    # Write to disk every 50 tests
 TEST_LIMIT = None          # Set to None for full production run
+NPROC = os.cpu_count() or 1  # Resolved once instead of a `$(nproc)` fork per test
+# -l keeps make from starting new jobs while the load is above the core count
+BUILD_CMD = ["make", f"-j{NPROC}", f"-l{NPROC}"]
+CONFIGURE_COV = "./configure --disable-asm --disable-doc --extra-cflags='--coverage' --extra-ldflags='--coverage'"
+CONFIGURE_REL = "./configure --disable-asm --disable-doc"
+# One `make fate-list` entry per line
+FATE_TEST_RE = re.compile(r"^\s*(fate-\S+)\s*$", re.MULTILINE)
 
 # Gist URL for the Unified CSV
 GIST_CSV_URL = "https://gist.githubusercontent.com/waheed-sep/935cfc1ba42b2475d45336a4c779cbc8/raw/ea91568360d87979373a7eca38f289c9bf30d103/cwe_projects.csv"
@@ -50,11 +58,13 @@ logging.getLogger('').addHandler(console)
 # HELPERS
 # ==========================================
 def run_command(command, cwd, ignore_errors=False):
+    # Argv lists are executed directly, without a /bin/sh in between
+    # stdout is never read, so it is discarded instead of buffered; stderr feeds the failure log
     try:
         env = os.environ.copy()
         env["LC_ALL"] = "C"
-        result = subprocess.run(command, cwd=cwd, shell=True, env=env,
-                                stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True)
+        result = subprocess.run(command, cwd=cwd, shell=isinstance(command, str), env=env,
+                                stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, universal_newlines=True)
         if result.returncode != 0 and not ignore_errors:
             logging.error(f"FAIL: {command}\nSTDERR: {result.stderr.strip()}")
             return False
@@ -93,33 +103,63 @@ def download_csv_if_missing():
             print(f"Error downloading CSV: {e}")
             sys.exit(1)
 
+def build_commit(commit, coverage):
+    """
+    Checks `commit` out in PROJECT_DIR from a clean tree and builds it,
+    instrumented for gcov when `coverage` is set.
+    """
+    clean_repo(PROJECT_DIR)
+    run_command(f"git checkout -f {commit}", PROJECT_DIR)
+    run_command(CONFIGURE_COV if coverage else CONFIGURE_REL, PROJECT_DIR)
+    return run_command(BUILD_CMD, PROJECT_DIR)
+
 def get_git_diff_files(cwd, commit_hash):
-    cmd = f"git diff-tree --no-commit-id --name-only -r {commit_hash}"
-    result = subprocess.run(cmd, cwd=cwd, shell=True, stdout=subprocess.PIPE, text=True)
+    cmd = ["git", "diff-tree", "--no-commit-id", "--name-only", "-r", commit_hash]
+    result = subprocess.run(cmd, cwd=cwd, stdout=subprocess.PIPE, text=True)
     return {f for f in result.stdout.strip().split('\n') if f}
 
-def get_fate_tests(cwd):
+def get_fate_tests(cwd, commit):
     if not os.path.exists(SAMPLES_DIR) or not os.listdir(SAMPLES_DIR):
         logging.warning(f"SAMPLES_DIR ({SAMPLES_DIR}) is empty or missing! Tests will fail.")
     
-    res = subprocess.run("make fate-list", cwd=cwd, shell=True, stdout=subprocess.PIPE, text=True)
-    tests = [l.strip() for l in res.stdout.split('\n') if l.strip().startswith("fate-")]
+    # `make fate-list` re-parses the whole build system; its output only depends on
+    # the commit (the configure flags are always the same), so it is kept per commit
+    list_cache = os.path.join(CACHE_DIR, f"fate_list_{commit}.json")
+    tests = load_json(list_cache).get("tests")
+    if not tests:
+        res = subprocess.run("make fate-list", cwd=cwd, shell=True, stdout=subprocess.PIPE, text=True)
+        tests = FATE_TEST_RE.findall(res.stdout)
+        if res.returncode == 0 and tests:
+            save_json(list_cache, {"tests": tests})
     
     if TEST_LIMIT: 
         tests = tests[:TEST_LIMIT]
         
-    return [{"name": t, "cmd": f"make {t} SAMPLES={SAMPLES_DIR} -j$(nproc)"} for t in tests]
+    return [{"name": t, "cmd": ["make", t, f"SAMPLES={SAMPLES_DIR}", f"-j{NPROC}"]} for t in tests]
 
 def get_covered_files(cwd):
     covered = set()
-    for root, dirs, files in os.walk(cwd):
+    # fwalk joins every root onto `cwd`, so slicing off that prefix gives the
+    # relative directory without os.path.relpath splitting both paths
+    skip = len(os.path.join(cwd, ""))
+    # fwalk lists every directory through an open fd (openat), so the kernel
+    # resolves each directory path once instead of once per file
+    for root, dirs, files, dirfd in os.fwalk(cwd):
+        prefix = root[skip:] + os.sep if len(root) > skip else ""
         for file in files:
             if file.endswith(".gcda"):
-                source_name = file.replace(".gcda", ".c")
-                rel_dir = os.path.relpath(root, cwd)
-                full_path = source_name if rel_dir == "." else os.path.join(rel_dir, source_name)
-                covered.add(full_path)
-    return list(covered)
+                covered.add(prefix + file[:-5] + ".c")
+    return covered
+
+def purge_gcda_files(cwd):
+    # In-process replacement for `find . -name '*.gcda' -delete`, unlinking relative to the directory fd
+    for root, dirs, files, dirfd in os.fwalk(cwd):
+        for file in files:
+            if file.endswith(".gcda"):
+                try:
+                    os.unlink(file, dir_fd=dirfd)
+                except FileNotFoundError:
+                    pass
 
 def flush_buffer_to_csv(filepath, buffer, fieldnames):
     if not buffer: return
@@ -165,12 +205,9 @@ def run_phase_1_coverage(vuln, fix, master_csv_path, checkpoint_path):
     # A. VULN COMMIT
     if cached_data.get("status") != "COMPLETE":
         logging.info(f"Building Vuln {vuln} (Coverage)...")
-        clean_repo(PROJECT_DIR)
-        run_command(f"git checkout -f {vuln}", PROJECT_DIR)
-        run_command("./configure --disable-asm --disable-doc --extra-cflags='--coverage' --extra-ldflags='--coverage'", PROJECT_DIR)
-        run_command("make -j$(nproc)", PROJECT_DIR)
+        build_commit(vuln, coverage=True)
         
-        suite = get_fate_tests(PROJECT_DIR)
+        suite = get_fate_tests(PROJECT_DIR, vuln)
         print(f"Running {len(suite)} tests for Vuln Commit...")
 
         for i, test in enumerate(suite):
@@ -179,7 +216,7 @@ def run_phase_1_coverage(vuln, fix, master_csv_path, checkpoint_path):
             
             if i % 20 == 0: print(f"  [P1-Vuln] {i}/{len(suite)}: {t_name}")
             
-            run_command("find . -name '*.gcda' -delete", PROJECT_DIR)
+            purge_gcda_files(PROJECT_DIR)
             run_command(test['cmd'], PROJECT_DIR, ignore_errors=True)
             
             covered = get_covered_files(PROJECT_DIR)
@@ -193,12 +230,9 @@ def run_phase_1_coverage(vuln, fix, master_csv_path, checkpoint_path):
 
     # B. FIX COMMIT
     logging.info(f"Building Fix {fix} (Coverage)...")
-    clean_repo(PROJECT_DIR)
-    run_command(f"git checkout -f {fix}", PROJECT_DIR)
-    run_command("./configure --disable-asm --disable-doc --extra-cflags='--coverage' --extra-ldflags='--coverage'", PROJECT_DIR)
-    run_command("make -j$(nproc)", PROJECT_DIR)
+    build_commit(fix, coverage=True)
 
-    suite = get_fate_tests(PROJECT_DIR)
+    suite = get_fate_tests(PROJECT_DIR, fix)
     csv_buffer = []
     csv_header = ["project", "vuln_commit", "v_testname", "fix_commit", "f_testname", "sourcefile"]
     
@@ -207,13 +241,15 @@ def run_phase_1_coverage(vuln, fix, master_csv_path, checkpoint_path):
         t_name = test['name']
         if i % 20 == 0: print(f"  [P1-Fix] {i}/{len(suite)}: {t_name}")
 
-        run_command("find . -name '*.gcda' -delete", PROJECT_DIR)
+        purge_gcda_files(PROJECT_DIR)
         run_command(test['cmd'], PROJECT_DIR, ignore_errors=True)
         
         covered = get_covered_files(PROJECT_DIR)
         
+        # Look-ups below are set membership tests, not list scans
+        v_files = set(vuln_results.get(t_name, ()))
         for target in target_files:
-            v_covered = (t_name in vuln_results) and (target in vuln_results[t_name])
+            v_covered = target in v_files
             f_covered = target in covered
 
             if v_covered or f_covered:
@@ -303,10 +339,7 @@ def run_phase_2_energy(master_p1_csv, master_p2_csv, checkpoint_path, current_vu
         if not todos: continue
         
         logging.info(f"Building {commit} (Standard)...")
-        clean_repo(PROJECT_DIR)
-        run_command(f"git checkout -f {commit}", PROJECT_DIR)
-        run_command("./configure --disable-asm --disable-doc", PROJECT_DIR)
-        run_command("make -j$(nproc)", PROJECT_DIR)
+        build_commit(commit, coverage=False)
 
         for i, test in enumerate(todos):
             print(f"  [P2-Measure] {commit[:8]} - {test} ({i+1}/{len(todos)})")
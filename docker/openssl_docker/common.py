@@ -2,49 +2,177 @@ import os
 import logging
 import yaml
 import subprocess
+import functools
 import urllib.request
 import sys
 import re
+import struct
+import time
 
 class ProgressBar:
+    __slots__ = ('total', 'length', 'step', 'current', '_full', '_empty', '_last_filled', '_last_t', '_tty')
+
     def __init__(self, total, length=40, step=1):
         self.total = total
         self.length = length
         self.step = step
+        self.current = 0
+        self._full = '█' * length
+        self._empty = '░' * length
+        self._last_filled = -1
+        self._last_t = 0.0
+        # The bar goes to stderr, and only when it is an interactive terminal
+        self._tty = sys.stderr.isatty()
 
     def update(self, i):
-        progress = (i + 1) / self.total
-        filled = int(self.length * progress)
-        bar = '█' * filled + '░' * (self.length - filled)
-        print(f"\r[{bar}] {i+1}/{self.total}", end='', flush=True)
+        # Redraw every `step` items (and on the last one), only when the bar actually moves
+        if (i + 1) % self.step and i + 1 != self.total:
+            return
+        self._draw(i)
+
+    def _draw(self, i):
+        if not self._tty:
+            return
+        filled = (i + 1) * self.length // self.total
+        if filled == self._last_filled:
+            return
+        # At most 10 redraws per second, but always draw the completed bar
+        now = time.monotonic()
+        if now - self._last_t < 0.1 and i + 1 != self.total:
+            return
+        self._last_filled = filled
+        self._last_t = now
+        bar = self._full[:filled] + self._empty[:self.length - filled]
+        # One raw write, bypassing print and the TextIOWrapper buffering
+        os.write(2, f"\r[{bar}] {i+1}/{self.total}".encode())
 
     def log(self, msg):
-        print()
+        if self._tty:
+            os.write(2, b"\n")
         print(msg)
-        self.update(self.current)
+        self._last_filled = -1
+        self._last_t = 0.0
+        self._draw(self.current)
 
     def set(self, i):
         self.current = i
         self.update(i)
 
+ENERGY_RE = re.compile(r'\bpower/energy-[^/\s]+/?\b')
+
+# Every RAPL domain the kernel's power PMU can expose
+RAPL_DOMAINS = frozenset({"pkg", "cores", "ram", "gpu", "psys"})
+
+# libyaml-backed loader when PyYAML was built with it, same safe semantics
+YAML_LOADER = getattr(yaml, "CSafeLoader", yaml.SafeLoader)
+
+# Directories never holding coverage data of the build under test
+PURGE_SKIP_DIRS = {".git", ".ccache", "ccache"}
+
+# gcov record tag of the arc execution counters, and the (tag, length) record header
+GCOV_TAG_ARC_COUNTS = 0x01a10000
+GCOV_RECORD_LE = struct.Struct('<Ii')
+GCOV_RECORD_BE = struct.Struct('>Ii')
+
 GIST_CSV_URL = "https://gist.githubusercontent.com/waheed-sep/935cfc1ba42b2475d45336a4c779cbc8/raw/ea91568360d87979373a7eca38f289c9bf30d103/cwe_projects.csv"
 
+def gcda_has_hits(path):
+    """
+    Tells whether a .gcda file records at least one executed arc.
+    The runtime writes a .gcda for every instrumented object linked into the
+    program, even if none of its code ran, so presence alone over-reports.
+    Files in a layout this reader does not know count as hit.
+
+    :param path: Path of the .gcda file
+    """
+    try:
+        with open(path, 'rb') as f:
+            data = f.read()
+    except OSError:
+        return False
+
+    if data[:4] == b'adcg':
+        record, version = GCOV_RECORD_LE, data[4:8][::-1]
+    elif data[:4] == b'gcda':
+        record, version = GCOV_RECORD_BE, data[4:8]
+    else:
+        return True
+    try:
+        # "B22*" is GCC 12.2, "A93*" GCC 9.3, "407*" GCC 4.7
+        major = (version[0] - ord('A')) * 10 + int(chr(version[1])) if chr(version[0]).isalpha() else int(chr(version[0]))
+    except ValueError:
+        return True
+
+    # GCC 12 appended a checksum to the header, switched record lengths from words
+    # to bytes and stores all-zero counter records with a negative length and no data
+    pos, unit = (16, 1) if major >= 12 else (12, 4)
+    while pos + 8 <= len(data):
+        tag, length = record.unpack_from(data, pos)
+        pos += 8
+        if length < 0:
+            continue
+        size = length * unit
+        if tag == GCOV_TAG_ARC_COUNTS and data[pos:pos + size].strip(b'\0'):
+            return True
+        pos += size
+    return False
+
 def get_covered_files(cwd):
     """
     Scans the given directory for .gcda files and maps them to their corresponding .c source files.
-    Returns a list of source file paths relative to the cwd.
+    Only objects with at least one executed arc (see gcda_has_hits) count as covered.
+    Returns a set of source file paths relative to the cwd.
 
     :param cwd: Description
     """
     covered = set()
-    for root, dirs, files in os.walk(cwd):
-        for file in files:
-            if file.endswith(".gcda"):
-                source_name = file.replace(".gcda", ".c")
-                rel_dir = os.path.relpath(root, cwd)
-                full_path = source_name if rel_dir == "." else os.path.join(rel_dir, source_name)
-                covered.add(full_path)
-    return list(covered)
+    # Iterative scandir walk: DirEntry carries the d_type, so no extra stat per
+    # entry, and the relative prefix is carried down instead of using relpath.
+    stack = [(cwd, "")]
+    while stack:
+        path, rel = stack.pop()
+        try:
+            it = os.scandir(path)
+        except OSError:
+            continue
+        with it:
+            for entry in it:
+                if entry.is_dir(follow_symlinks=False):
+                    stack.append((entry.path, rel + entry.name + "/"))
+                elif entry.name.endswith(".gcda") and gcda_has_hits(entry.path):
+                    covered.add(rel + entry.name[:-5] + ".c")
+    return covered
+
+def purge_gcda_files(cwd):
+    """
+    Deletes every .gcda file under `cwd` in a single in-process scandir walk,
+    replacing a `find . -name '*.gcda' -delete` fork per test.
+    .gcno notes are compile-time output and are left alone.
+    Each directory is opened once and its files are unlinked relative to that
+    descriptor (unlinkat), so the kernel never re-resolves the full path.
+
+    :param cwd: Root of the build tree
+    """
+    stack = [cwd]
+    while stack:
+        path = stack.pop()
+        try:
+            dir_fd = os.open(path, os.O_RDONLY | os.O_DIRECTORY)
+        except OSError:
+            continue
+        try:
+            with os.scandir(dir_fd) as it:
+                for entry in it:
+                    if entry.is_dir(follow_symlinks=False):
+                        if entry.name not in PURGE_SKIP_DIRS:
+                            stack.append(os.path.join(path, entry.name))
+                    elif entry.name.endswith(".gcda"):
+                        try:
+                            os.unlink(entry.name, dir_fd=dir_fd)
+                        except FileNotFoundError:
+                            pass
+        finally:
+            os.close(dir_fd)
 
 def download_csv_if_missing(input_csv):
     if not os.path.exists(input_csv):
@@ -62,18 +190,25 @@ def read_configuration(config_file):
         try:
             with open(config_file, 'r') as f:
                 logging.info(f"Configuration loaded from {config_file}")
-                return yaml.safe_load(f)
+                return yaml.load(f, Loader=YAML_LOADER)
         except Exception as e:
             logging.error(f"Error reading configuration file: {e}")
     else:
         logging.info(f"No configuration file found at {config_file}")
 
-def run_command(command, cwd, ignore_errors=False):
+def run_command(command, cwd, ignore_errors=False, env=None):
+    """
+    Runs `command` in `cwd`. Argv lists are executed directly so no /bin/sh is
+    spawned; plain strings still go through the shell for pipes and globs.
+    `env` entries are added on top of the current environment.
+    Only stderr is captured, for the failure log; stdout is discarded.
+    """
     try:
-        env = os.environ.copy()
-        env["LC_ALL"] = "C"
-        result = subprocess.run(command, cwd=cwd, shell=True, env=env,
-                                stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True)
+        cmd_env = os.environ.copy()
+        cmd_env["LC_ALL"] = "C"
+        if env: cmd_env.update(env)
+        result = subprocess.run(command, cwd=cwd, shell=isinstance(command, str), env=cmd_env,
+                                stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, universal_newlines=True)
         if result.returncode != 0 and not ignore_errors:
             logging.error(f"FAIL: {command}\nSTDERR: {result.stderr.strip()}")
             return False
@@ -82,31 +217,66 @@ def run_command(command, cwd, ignore_errors=False):
         logging.error(f"EXCEPTION: {e}")
         return False
 
-def get_git_diff_files(cwd, commit_hash):
-    cmd = f"git diff-tree --no-commit-id --name-only -r {commit_hash}"
-    result = subprocess.run(cmd, cwd=cwd, shell=True, stdout=subprocess.PIPE, text=True)
-    return {f for f in result.stdout.strip().split('\n') if f}
+@functools.lru_cache(maxsize=4096)
+def get_git_diff_files(cwd, commit_hash, pathspecs=()):
+    # A commit's diff never changes, so results are memoized per (repo, commit, pathspecs);
+    # the frozenset keeps the cached value safe from callers mutating it.
+    # Pathspecs make git itself drop the paths we are not interested in
+    cmd = ["git", "diff-tree", "--no-commit-id", "--name-only", "-r", commit_hash, "--", *pathspecs]
+    result = subprocess.run(cmd, cwd=cwd, stdout=subprocess.PIPE, text=True)
+    return frozenset(f for f in result.stdout.strip().split('\n') if f)
+
+def iter_commits_files(cwd, commits, pathspecs=()):
+    """
+    Yields (commit, changed_files) for every commit in `commits` using a single
+    `git log` process instead of one `git diff-tree` per commit.
+    With `pathspecs`, commits touching none of the matching paths are not yielded.
+
+    :param cwd: Path of the git repository
+    :param commits: Iterable of full commit hashes
+    :param pathspecs: Optional git pathspecs restricting the reported files
+    """
+    cmd = ["git", "log", "--no-walk=unsorted", "--name-only", "--pretty=format:%x00%H", *commits, "--", *pathspecs]
+    with subprocess.Popen(cmd, cwd=cwd, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True) as proc:
+        commit, files = None, set()
+        for line in proc.stdout:
+            line = line.rstrip('\n')
+            # Every commit section starts with the NUL-prefixed hash
+            if line.startswith('\x00'):
+                if commit is not None:
+                    yield commit, files
+                commit, files = line[1:], set()
+            elif line:
+                files.add(line)
+        if commit is not None:
+            yield commit, files
 
 def clean_repo(cwd):
-    run_command("git reset --hard", cwd)
-    run_command("git clean -fdx", cwd)
+    run_command(["git", "reset", "--hard"], cwd)
+    run_command(["git", "clean", "-fdx"], cwd)
+
+def _scan_perf_list(cmd):
+    """
+    Streams `perf list` output line by line, collecting the RAPL energy events,
+    and stops reading as soon as every RAPL domain has been seen.
+    Returns (events, ok), where ok is False when perf failed without output.
+    """
+    events = set()
+    with subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True) as proc:
+        for line in proc.stdout:
+            for m in ENERGY_RE.finditer(line):
+                ev = m.group(0)
+                # Normalize to the canonical perf selector form with trailing '/'
+                events.add(ev if ev.endswith("/") else ev + "/")
+            if {ev[len("power/energy-"):-1] for ev in events} >= RAPL_DOMAINS:
+                proc.terminate()
+                break
+    return events, bool(events) or proc.returncode == 0
 
 def detect_rapl(perf_bin="perf"):
-    ENERGY_RE = re.compile(r'\bpower/energy-[^/\s]+/?\b')
     # --no-desc makes output easier to parse if supported; if not, fall back.
-    cmd = [perf_bin, "list", "--no-desc"]
-    try:
-        out = subprocess.check_output(cmd, text=True, stderr=subprocess.STDOUT)
-    except subprocess.CalledProcessError:
-        out = subprocess.check_output([perf_bin, "list"], text=True, stderr=subprocess.STDOUT)
-
-    events = set()
-    for line in out.splitlines():
-        # Grab all matches from the line (some lines may include multiple tokens)
-        for m in ENERGY_RE.findall(line):
-            # Normalize to the canonical perf selector form with trailing '/'
-            if not m.endswith("/"):
-                m += "/"
-            events.add(m)
+    events, ok = _scan_perf_list([perf_bin, "list", "--no-desc"])
+    if not ok:
+        events, _ = _scan_perf_list([perf_bin, "list"])
 
     return sorted(events)
\ No newline at end of file
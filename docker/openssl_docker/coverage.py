@@ -28,7 +28,7 @@ def process_commit(commit, coverage=True):
             }
 
             # Clean previous coverage data
-            common.run_command("find . -name '*.gcda' -delete", PROJECT_DIR)
+            common.purge_gcda_files(PROJECT_DIR)
             
             # For Coverage, 'make target' is fine as it usually runs the test too or we assume build covers it.
             # But usually we need to RUN it to get coverage.
@@ -1,37 +1,34 @@
 import os
 import subprocess
+import functools
 import csv
 import logging
 import json
 import time
 import sys
 import urllib.request
-import pandas as pd
-import re
+import struct
 import shlex
+import shutil
+import platform
+import queue
+import threading
+import contextlib
+from collections import deque
 import yaml
+from concurrent.futures import ThreadPoolExecutor
+# Helpers shared with the other OpenSSL scripts live in common.py only
+from common import (
+    ProgressBar, YAML_LOADER, PURGE_SKIP_DIRS, GIST_CSV_URL,
+    run_command, get_covered_files, purge_gcda_files,
+    get_git_diff_files, iter_commits_files, _scan_perf_list,
+)
 
+try:
+    import orjson
+except ImportError:
+    orjson = None
 
-class ProgressBar:
-    def __init__(self, total, length=40, step=1):
-        self.total = total
-        self.length = length
-        self.step = step
-
-    def update(self, i):
-        progress = (i + 1) / self.total
-        filled = int(self.length * progress)
-        bar = '█' * filled + '░' * (self.length - filled)
-        print(f"\r[{bar}] {i+1}/{self.total}", end='', flush=True)
-
-    def log(self, msg):
-        print()
-        print(msg)
-        self.update(self.current)
-
-    def set(self, i):
-        self.current = i
-        self.update(i)
 
 # ==========================================
 # CONFIGURATION
@@ -41,8 +38,6 @@ TARGET_DURATION_SEC = 2.0
 CSV_WRITE_INTERVAL = 50
 TEST_LIMIT = None
 
-GIST_CSV_URL = "https://gist.githubusercontent.com/waheed-sep/935cfc1ba42b2475d45336a4c779cbc8/raw/ea91568360d87979373a7eca38f289c9bf30d103/cwe_projects.csv"
-
 # ==========================================
 # PATHS
 # ==========================================
@@ -53,16 +48,88 @@ INPUT_CSV = os.path.join(INPUT_DIR, "cwe_projects.csv")
 PROJECT_DIR = os.path.join(INPUT_DIR, REPO_NAME)
 LOG_DIR = os.path.join(OUTPUT_DIR, "log")
 CACHE_DIR = os.path.join(LOG_DIR, "cache")
-GCDA_DIR = os.path.join(OUTPUT_DIR, "gcda_files")
+# Per-test .gcda files are read and deleted as soon as their test ends, so they go to
+# tmpfs when there is a large enough one: gcov flushes many small files, the output
+# volume is slow. Docker's default /dev/shm is only 64M, run with --shm-size=1g or more.
+SHM_DIR = "/dev/shm"
+SHM_MIN_FREE = 1 << 30
+GCDA_DIR = (os.path.join(SHM_DIR, "vfec_gcda_files")
+            if os.path.isdir(SHM_DIR) and shutil.disk_usage(SHM_DIR).free >= SHM_MIN_FREE
+            else os.path.join(OUTPUT_DIR, "gcda_files"))
+WORKTREE_DIR = os.path.join(INPUT_DIR, "worktrees")
+CCACHE_DIR = os.path.join(OUTPUT_DIR, "ccache")
+RAPL_CACHE = os.path.join(CACHE_DIR, "rapl_events.json")
+PERF_DIR = os.path.join(OUTPUT_DIR, REPO_NAME, "perf")
+POWERCAP_DIR = "/sys/class/powercap"
+RAPL_PMU_CPUMASK = "/sys/bus/event_source/devices/power/cpumask"
+
+# Characters of a full SHA-1 object name, as git writes it in a detached HEAD
+HEX_DIGITS = frozenset("0123456789abcdef")
+
+# Overlap the coverage phase of the next pair with the energy phase of the current one.
+# Coverage builds and tests run on COVERAGE_CORES, the measured tests on ENERGY_CORES;
+# RAPL package energy covers the whole socket though, so MEASUREMENT_GATE still
+# pauses coverage work for as long as a commit's tests are being measured.
+PIPELINE_PHASES = True
+AVAILABLE_CORES = sorted(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else []
+
+def _pick_energy_cpu():
+    """
+    Returns the CPU the measured tests run on: VFEC_MEASURE_CPU when it names an
+    available CPU, the highest available one otherwise. Never CPU 0 by default:
+    it serves most IRQs and timers, and isolcpus=/nohz_full= cannot isolate it.
+    """
+    override = os.environ.get("VFEC_MEASURE_CPU", "").strip()
+    if override.isdigit() and int(override) in AVAILABLE_CORES:
+        return int(override)
+    return max(AVAILABLE_CORES) if AVAILABLE_CORES else None
+
+ENERGY_CPU = _pick_energy_cpu()
+ENERGY_CORES = {ENERGY_CPU} if ENERGY_CPU is not None else set()
+COVERAGE_CORES = (set(AVAILABLE_CORES) - ENERGY_CORES) or ENERGY_CORES
+
+# CPU the measured tests are pinned to (taskset) and the only one cycles/instructions
+# are counted on. Best isolated from the scheduler at boot: isolcpus=N nohz_full=N rcu_nocbs=N
+MEASURE_CPU = ENERGY_CPU if shutil.which("taskset") else None
+
+# Online CPUs, resolved once; the make load limit is set against all of them
+NPROC = os.cpu_count() or 1
+
+# Concurrent coverage test runs; each test writes its .gcda files to its own GCOV_PREFIX
+COVERAGE_WORKERS = len(COVERAGE_CORES) or NPROC
+
+# Pairs covered at the same time in the pipelined mode; each of them already runs its tests
+# on COVERAGE_WORKERS threads, so a couple of pairs is enough to fill the gaps between builds
+COVERAGE_PAIR_WORKERS = 2
+
+# `git worktree add/remove/prune` of the two phases must not interleave
+WORKTREE_LOCK = threading.Lock()
 
 ITERATIONS = 5
+# Read package/core/dram energy straight from the powercap sysfs counters instead of
+# running perf. Much cheaper, but cycles and instructions are not recorded then.
+POWERCAP_ONLY = False
 DEFAULT_TIMEOUT_MS = 1000  # 1 second
 COOL_DOWN_TO_SEC = 1.0
 
-ENERGY_RE = re.compile(r'\bpower/energy-[^/\s]+/?\b')
+# Compiler used by configure_openssl, through ccache when it is installed
+CC = "ccache gcc" if shutil.which("ccache") else "gcc"
+# Written into a build dir by configure_openssl, identifies how it was configured
+CONFIG_STAMP = ".config_stamp"
+# Part of the per-commit coverage cache names (get_tests_path). Bump it whenever the
+# cached records would come out differently: coverage build flags, test commands,
+# get_covered_files/gcda_has_hits or the record layout
+COVERAGE_CACHE_VERSION = 2
+
+# Only changes to these files can show up in the .gcda-derived coverage
+SOURCE_EXTENSIONS = ('.c', '.cpp', '.h', '.hpp')
+SOURCE_PATHSPECS = tuple('*' + ext for ext in SOURCE_EXTENSIONS)
+
+# One measured window of one event: test index, event index, window end (ns), value
+MEASUREMENT_RECORD = struct.Struct('<IIqd')
 
 def prepare_directories():
-    for d in [INPUT_DIR, OUTPUT_DIR, LOG_DIR, CACHE_DIR, GCDA_DIR]:
+    for d in [INPUT_DIR, OUTPUT_DIR, LOG_DIR, CACHE_DIR, GCDA_DIR, WORKTREE_DIR, CCACHE_DIR, PERF_DIR]:
         if not os.path.exists(d): os.makedirs(d)
         
 
@@ -70,23 +137,25 @@ def setup_logging():
     LOG_FILE = os.path.join(LOG_DIR, "pipeline_execution.log")
     logging.basicConfig(filename=LOG_FILE, level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
+def setup_ccache():
+    """
+    Point ccache at a persistent cache under OUTPUT_DIR so the coverage and
+    non-coverage builds of a commit, and reruns of the pipeline, hit the cache.
+    """
+    if CC == "gcc":
+        logging.info("ccache not found, building without a compiler cache.")
+        return
+    os.environ.setdefault("CCACHE_DIR", CCACHE_DIR)
+    os.environ.setdefault("CCACHE_MAXSIZE", "20G")
+    # Key the cache on the compiler binary's content, not its mtime, so the cache
+    # survives rebuilt images that ship the very same gcc
+    os.environ.setdefault("CCACHE_COMPILERCHECK", "content")
+    # Rewrite worktree paths to relative ones so different worktrees share entries
+    os.environ.setdefault("CCACHE_BASEDIR", WORKTREE_DIR)
+
 # ==========================================
 # HELPERS
 # ==========================================
-def run_command(command, cwd, ignore_errors=False):
-    try:
-        env = os.environ.copy()
-        env["LC_ALL"] = "C"
-        result = subprocess.run(command, cwd=cwd, shell=True, env=env,
-                                stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True)
-        if result.returncode != 0 and not ignore_errors:
-            logging.error(f"FAIL: {command}\nSTDERR: {result.stderr.strip()}")
-            return False
-        return True
-    except Exception as e:
-        logging.error(f"EXCEPTION: {e}")
-        return False
-
 def save_json(filepath, data):
     try:
         with open(filepath, 'w') as f:
@@ -94,6 +163,33 @@ def save_json(filepath, data):
     except Exception as e:
         logging.error(f"JSON Save Error: {e}")
 
+def _json_default(obj):
+    # Sets (e.g. covered_files) are kept as sets while processing and only become lists here
+    if isinstance(obj, (set, frozenset)):
+        return sorted(obj)
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+def dump_json_bytes(data):
+    """
+    Serializes `data` to indented JSON bytes, with orjson when it is installed
+    and the stdlib json module otherwise. Sets are written as sorted lists.
+    """
+    if orjson is not None:
+        return orjson.dumps(data, default=_json_default, option=orjson.OPT_INDENT_2)
+    return json.dumps(data, indent=2, default=_json_default).encode()
+
+def dump_json_line(data):
+    # One compact JSON document per line, for JSON Lines files
+    if orjson is not None:
+        return orjson.dumps(data, default=_json_default) + b"\n"
+    return json.dumps(data, default=_json_default).encode() + b"\n"
+
+def iter_json_lines(filepath):
+    with open(filepath, 'rb') as f:
+        for line in f:
+            if line.strip():
+                yield orjson.loads(line) if orjson is not None else json.loads(line)
+
 def load_json(filepath):
     if os.path.exists(filepath):
         try:
@@ -103,9 +199,110 @@ def load_json(filepath):
             return {}
     return {}
 
-def clean_repo(cwd):
-    run_command("git reset --hard", cwd)
-    run_command("git clean -fdx", cwd)
+def checkout_worktree(commit, prefix=""):
+    """
+    Checks out `commit` into its own linked worktree under WORKTREE_DIR.
+    The worktree shares PROJECT_DIR's object store, so switching commits never
+    needs a `git reset --hard` + `git clean -fdx` of the main checkout.
+    Returns the worktree path, or None if the checkout fails.
+
+    :param commit: The git commit hash to check out
+    :param prefix: Prepended to the worktree name, so the same commit can be checked
+        out for two pairs that are processed at the same time
+    """
+    worktree = os.path.join(WORKTREE_DIR, prefix + commit[:8])
+    if os.path.exists(worktree):
+        # Already at the right commit (e.g. left behind by the coverage phase or by an
+        # interrupted run): reuse it, the build steps reconfigure anyway
+        if get_worktree_head(worktree) == commit:
+            return worktree
+        remove_worktree(worktree)
+    with WORKTREE_LOCK:
+        if not run_command(["git", "worktree", "add", "--detach", "--quiet", worktree, commit], PROJECT_DIR,
+                           env={"GIT_INDEX_VERSION": "4"}):
+            return None
+    return worktree
+
+def get_worktree_head(worktree):
+    """
+    Returns the commit checked out in `worktree`. A detached linked worktree
+    records it as a bare hash in the HEAD of its gitdir, which is read directly;
+    `git rev-parse` is only spawned for any other layout.
+    """
+    try:
+        with open(os.path.join(worktree, ".git")) as f:
+            gitdir = f.read().strip().removeprefix("gitdir: ")
+        with open(os.path.join(worktree, gitdir, "HEAD")) as f:
+            head = f.read().strip()
+        if len(head) == 40 and all(c in HEX_DIGITS for c in head):
+            return head
+    except (OSError, UnicodeDecodeError):
+        pass
+    result = subprocess.run(["git", "rev-parse", "HEAD"], cwd=worktree,
+                            stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True)
+    return result.stdout.strip() if result.returncode == 0 else None
+
+def remove_worktree(worktree):
+    with WORKTREE_LOCK:
+        run_command(["git", "worktree", "remove", "--force", worktree], PROJECT_DIR, ignore_errors=True)
+        run_command(["git", "worktree", "prune"], PROJECT_DIR, ignore_errors=True)
+    for coverage in (True, False):
+        build_dir = get_build_dir(worktree, coverage)
+        if build_dir != worktree:
+            shutil.rmtree(build_dir, ignore_errors=True)
+
+class MeasurementGate:
+    """
+    Keeps coverage work and energy measurements from running at the same time.
+    Any number of coverage steps (a checkout, a build, a test) may run together;
+    a measurement waits for the running ones to finish and holds new ones back
+    until it is done. Energy builds take no part, so they still overlap coverage.
+    """
+    __slots__ = ('_cond', '_steps', '_measuring')
+
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._steps = 0
+        self._measuring = 0
+
+    @contextlib.contextmanager
+    def coverage_step(self):
+        with self._cond:
+            while self._measuring:
+                self._cond.wait()
+            self._steps += 1
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._steps -= 1
+                self._cond.notify_all()
+
+    @contextlib.contextmanager
+    def measuring(self):
+        with self._cond:
+            # Counted before waiting, so coverage steps cannot starve the measurement
+            self._measuring += 1
+            while self._steps:
+                self._cond.wait()
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._measuring -= 1
+                self._cond.notify_all()
+
+MEASUREMENT_GATE = MeasurementGate()
+
+def pin_current_thread(cores):
+    """
+    Restricts the calling thread, and every process or thread it starts
+    afterwards, to `cores`. No-op where CPU affinity is not supported.
+
+    :param cores: Set of CPU ids
+    """
+    if cores and hasattr(os, "sched_setaffinity"):
+        os.sched_setaffinity(0, cores)
 
 def download_csv_if_missing():
     if not os.path.exists(INPUT_CSV):
@@ -117,27 +314,50 @@ def download_csv_if_missing():
             print(f"Error downloading CSV: {e}")
             sys.exit(1)
 
-def get_git_diff_files(cwd, commit_hash):
-    cmd = f"git diff-tree --no-commit-id --name-only -r {commit_hash}"
-    result = subprocess.run(cmd, cwd=cwd, shell=True, stdout=subprocess.PIPE, text=True)
-    return {f for f in result.stdout.strip().split('\n') if f}
-
-def get_covered_files(cwd):
+def get_build_dependencies(build_dir, cwd):
     """
-    Scans the given directory for .gcda files and maps them to their corresponding .c source files.
-    Returns a list of source file paths relative to the cwd.
+    Collects the sources and headers every object of a build depends on, from
+    the `.d` files gcc emits next to the objects (OpenSSL >= 1.1.0).
+    Returns a set of paths relative to the source tree, or None when the build
+    has no `.d` files (legacy releases keep their dependencies in the Makefile).
 
-    :param cwd: Description
+    :param build_dir: The directory holding the build
+    :param cwd: The worktree holding the sources
     """
-    covered = set()
-    for root, dirs, files in os.walk(cwd):
-        for file in files:
-            if file.endswith(".gcda"):
-                source_name = file.replace(".gcda", ".c")
-                rel_dir = os.path.relpath(root, cwd)
-                full_path = source_name if rel_dir == "." else os.path.join(rel_dir, source_name)
-                covered.add(full_path)
-    return list(covered)
+    deps = set()
+    found = False
+    # Both roots are absolute and normalized, so a plain string prefix test
+    # replaces os.path.relpath on every prerequisite
+    src_prefix = os.path.join(os.path.abspath(cwd), "")
+    build_root = os.path.abspath(build_dir)
+    stack = [build_root]
+    while stack:
+        path = stack.pop()
+        try:
+            it = os.scandir(path)
+        except OSError:
+            continue
+        with it:
+            for entry in it:
+                if entry.is_dir(follow_symlinks=False):
+                    if entry.name not in PURGE_SKIP_DIRS:
+                        stack.append(entry.path)
+                elif entry.name.endswith(".d"):
+                    try:
+                        with open(entry.path, 'r', errors='replace') as f:
+                            tokens = f.read().replace("\\\n", " ").split()
+                    except OSError:
+                        continue
+                    found = True
+                    for tok in tokens:
+                        # Skip the `target:` entries, keep the prerequisites;
+                        # relative ones are relative to where make ran the compiler
+                        if tok.endswith(":"):
+                            continue
+                        dep = os.path.normpath(os.path.join(build_root, tok))
+                        if dep.startswith(src_prefix):
+                            deps.add(dep[len(src_prefix):])
+    return deps if found else None
 
 def flush_buffer_to_csv(filepath, buffer, fieldnames):
     if not buffer: return
@@ -157,59 +377,126 @@ def flush_buffer_to_csv(filepath, buffer, fieldnames):
 # ==========================================
 # OPENSSL CONFIGURATION & BUILD
 # ==========================================
-def configure_openssl(cwd, coverage=False):
-    config_args = ["./config", "-d", "no-shared", "no-asm", "no-threads"]
-    cflags = "-fPIC -Wno-error -Wno-implicit-function-declaration -Wno-format-security -std=gnu89 -O0"
+def get_build_dir(cwd, coverage):
+    """
+    Returns the directory the sources in `cwd` are built in.
+    OpenSSL >= 1.1.0 (test/recipes present) supports out-of-tree builds, so the
+    coverage and the plain build get their own sibling directories and never
+    have to `make clean` each other's objects. Older releases build in-tree.
+
+    :param cwd: The worktree holding the sources
+    :param coverage: Whether the build is instrumented for coverage
+    """
+    if not os.path.exists(os.path.join(cwd, "test", "recipes")):
+        return cwd
+    return f"{os.path.normpath(cwd)}_{'cov' if coverage else 'rel'}"
+
+def configure_openssl(cwd, coverage=False, cc=CC):
+    build_dir = get_build_dir(cwd, coverage)
+    # Out-of-tree builds run the source tree's scripts from inside the build directory
+    script_dir = os.path.abspath(cwd) if build_dir != cwd else "."
+    if build_dir != cwd:
+        os.makedirs(build_dir, exist_ok=True)
+
+    config_args = [f"{script_dir}/config", "no-shared", "no-asm", "no-threads"]
+    cflags = "-fPIC -Wno-error -Wno-implicit-function-declaration -Wno-format-security -std=gnu89"
     lflags = "-no-pie"
 
+    # The measured build keeps the target's own release optimization (-O3 on
+    # linux-x86_64): Configure's CFLAGS follow $(CC) on the command line, so an -O
+    # level inside CC would be overridden anyway. Only coverage builds use -d (-O0).
     if coverage:
-        cflags += " --coverage"
+        # Unoptimized debug build, so every source line maps to its own counters
+        config_args.insert(1, "-d")
+        cflags += " -O0 --coverage"
         lflags += " --coverage"
 
-    full_cmd = f'CC="gcc {cflags} {lflags}" {" ".join(config_args)}'
-    
-    if run_command(full_cmd, cwd, ignore_errors=True):
-        return True
-    
-    logging.info("Standard config failed, trying ./Configure linux-x86_64...")
-    fallback_cmd = f'CC="gcc {cflags} {lflags}" ./Configure linux-x86_64 no-shared no-asm'
-    return run_command(fallback_cmd, cwd)
-
-def build_openssl(cwd):
-    run_command("make clean", cwd, ignore_errors=True)
-    run_command("make depend", cwd, ignore_errors=True)
-    if run_command("make", cwd): 
+    cc_env = {"CC": f"{cc} {cflags} {lflags}"}
+
+    # A build dir already configured with the same options for the same commit
+    # (e.g. a worktree left behind by an interrupted run) is used as is
+    stamp_path = os.path.join(build_dir, CONFIG_STAMP)
+    stamp = json.dumps([get_worktree_head(cwd), config_args, cc_env])
+    try:
+        with open(stamp_path, 'r') as f:
+            if f.read() == stamp and os.path.exists(os.path.join(build_dir, "Makefile")):
+                logging.info(f"Reusing the configuration of {build_dir}.")
+                return True
+    except OSError:
+        pass
+
+    if not run_command(config_args, build_dir, ignore_errors=True, env=cc_env):
+        logging.info("Standard config failed, trying ./Configure linux-x86_64...")
+        fallback_args = [f"{script_dir}/Configure", "linux-x86_64", "no-shared", "no-asm"]
+        if not run_command(fallback_args, build_dir, env=cc_env):
+            return False
+
+    with open(stamp_path, 'w') as f:
+        f.write(stamp)
+    return True
+
+def get_build_jobs():
+    """
+    Returns the make arguments for a parallel build on the cores the calling thread
+    may run on (coverage and energy threads are pinned to different sets), keeping
+    two of them free when there are enough; `-l` holds new jobs back while
+    concurrent builds already saturate the machine.
+    """
+    cores = len(os.sched_getaffinity(0)) if AVAILABLE_CORES else NPROC
+    jobs = cores - 2 if cores > 4 else cores
+    return [f"-j{jobs}", f"-l{NPROC}"]
+
+def build_openssl(cwd, incremental=False):
+    """
+    Builds OpenSSL in `cwd` with parallel make jobs (see get_build_jobs).
+
+    :param cwd: The build directory
+    :param incremental: Trust make's dependency tracking instead of starting from
+        `make clean` + `make depend`; only safe for a dedicated out-of-tree build dir
+    """
+    if not incremental:
+        run_command(["make", "clean"], cwd, ignore_errors=True)
+        run_command(["make", "depend"], cwd, ignore_errors=True)
+    if run_command(["make", *get_build_jobs()], cwd): 
         return True
     logging.error("Make failed.")
     return False
 
+def list_dir(path):
+    """Returns the sorted entry names of `path`, or None when it cannot be listed."""
+    try:
+        return sorted(os.listdir(path))
+    except OSError:
+        return None
+
 def get_openssl_tests(cwd):
     tests = []
-    recipes_dir = os.path.join(cwd, "test", "recipes")
-    test_dir = os.path.join(cwd, "test")
+    # Each directory is listed once; a failed listing replaces the exists() probe
+    recipes = list_dir(os.path.join(cwd, "test", "recipes"))
+    legacy = list_dir(os.path.join(cwd, "test")) if recipes is None else None
 
     # Strategy 1: Modern OpenSSL
-    if os.path.exists(recipes_dir):
+    if recipes is not None:
         logging.info("Detected Modern OpenSSL.")
         try:
-            files = sorted(os.listdir(recipes_dir))
-            for f in files:
+            for f in recipes:
                 if f.endswith(".t"):
                     t_name = f[:-2]
-                    # Modern: 'make test' runs the test wrapper
+                    # Modern: 'make test' runs the test wrapper. A single recipe gains nothing
+                    # from HARNESS_JOBS, and tests already run side by side in the coverage
+                    # phase, so the harness stays serial; -s drops make's own chatter.
                     tests.append({
                         "name": t_name, 
-                        "cmd": f"make test TESTS='{t_name}'",
+                        "cmd": f"make -s --no-print-directory test TESTS='{t_name}' HARNESS_JOBS=1",
                         "type": "modern"
                     })
         except Exception: pass
 
     # Strategy 2: Legacy OpenSSL
-    elif os.path.exists(test_dir):
+    elif legacy is not None:
         logging.info("Detected Legacy OpenSSL.")
         try:
-            files = sorted(os.listdir(test_dir))
-            for f in files:
+            for f in legacy:
                 if f.startswith("test_") and f.endswith(".c"):
                     t_name = f[:-2]
                     # Legacy: We must BUILD with 'make' then RUN the binary
@@ -231,98 +518,195 @@ def get_openssl_tests(cwd):
         except Exception: pass
             
     if TEST_LIMIT and tests: tests = tests[:TEST_LIMIT]
+    # Tokenized once here, so running a test never needs a shell
+    for t in tests:
+        t["argv"] = shlex.split(t["cmd"])
     return tests
 
 # ==========================================
 # PHASE 1: COVERAGE
 # ==========================================
 
-def process_commit(commit: str, coverage: bool = True) -> (dict | None):
+def process_commit(commit: str, cwd: str, coverage: bool = True, changed_files=None) -> (dict | None):
     """ 
-    Process a single commit: checkout, build with coverage, run tests, collect coverage data.
+    Process a single commit: build with coverage, run tests, collect coverage data.
 
     :param commit: The git commit hash to process
+    :param cwd: The worktree where `commit` is checked out
     :param coverage: Whether to build with coverage instrumentation
-    :return: A dictionary with test results and coverage data, or None if build fails
+    :param changed_files: Files changed by the fix; when no object of the build
+        depends on any of them, the tests are recorded as skipped without running
+    :return: A dictionary with test results and coverage data, or None if build fails.
+        Test records are streamed to get_tests_path(commit, coverage) as they finish;
+        in memory they keep everything but covered_files, and "keep" is already set
+        when `changed_files` is given.
     """
     
-    logging.info(f"Building {commit[:8]} (Coverage)...")
-    clean_repo(PROJECT_DIR)
-    run_command(f"git checkout -f {commit}", PROJECT_DIR)
-    
     commit_results = {
         "hash": commit,
         "tests": []
     }
 
-    if not configure_openssl(PROJECT_DIR, coverage=coverage): return None
-    if not build_openssl(PROJECT_DIR): return None
+    targets = frozenset(changed_files) if changed_files is not None else None
+    def summarize(test):
+        if targets is not None:
+            test['keep'] = not targets.isdisjoint(test.pop('covered_files', ()))
+        return test
+
+    # A commit shared by several pairs is built and tested only once
+    tests_path = get_tests_path(commit, coverage)
+    if os.path.exists(tests_path):
+        logging.info(f"Reusing cached coverage results of {commit[:8]}.")
+        commit_results['tests'] = [summarize(t) for t in iter_json_lines(tests_path)]
+        if commit_results['tests']:
+            return commit_results
+
+    logging.info(f"Building {commit[:8]} (Coverage)...")
+
+    build_dir = get_build_dir(cwd, coverage)
+    with MEASUREMENT_GATE.coverage_step():
+        if not configure_openssl(cwd, coverage=coverage): return None
+        if not build_openssl(build_dir, incremental=build_dir != cwd): return None
     
-    suite = get_openssl_tests(PROJECT_DIR)
+    suite = get_openssl_tests(cwd)
+
+    # No test can cover a file that nothing in the build is compiled from
+    if changed_files is not None:
+        with MEASUREMENT_GATE.coverage_step():
+            deps = get_build_dependencies(build_dir, cwd)
+        if deps is not None and deps.isdisjoint(changed_files):
+            logging.info(f"No object of {commit[:8]} depends on the changed files, skipping {len(suite)} tests.")
+            commit_results['tests'] = [
+                {"name": t['name'], "failed": False, "skipped": True, "cmd": t['cmd'], "covered_files": set(), "keep": False}
+                for t in suite
+            ]
+            return commit_results
+
     print(f"\nRunning {len(suite)} tests...")
 
+    # Remove any counters left in the tree (only .gcda, the .gcno notes must survive);
+    # tests write theirs under GCDA_DIR
+    purge_gcda_files(build_dir)
+    # Named after the worktree, so concurrent pairs sharing a commit do not collide
+    gcov_root = os.path.join(GCDA_DIR, os.path.basename(os.path.normpath(cwd)))
+    # Cleared once here rather than per test, in case an interrupted run left it behind
+    shutil.rmtree(gcov_root, ignore_errors=True)
+    # gcov writes <GCOV_PREFIX>/<object path minus GCOV_PREFIX_STRIP leading dirs>,
+    # so stripping the build dir components keeps paths relative to the source root.
+    gcov_strip = str(len(os.path.abspath(build_dir).strip(os.sep).split(os.sep)))
+
+    # Legacy tests build their binaries with `make`, which is not safe to run concurrently
+    workers = COVERAGE_WORKERS if all(t.get("type") == "modern" for t in suite) else 1
+
+    # Written then renamed, so a concurrent pair never reads a half-written file
+    tmp_path = f"{tests_path}.{os.getpid()}.{threading.get_ident()}"
     pb = ProgressBar(len(suite), step=10)
-    for i, t in enumerate(suite):
-        pb.set(i)
-
-        test = {
-            "name": t['name'],
-            "failed": False,
-            "cmd": t['cmd'],
-            "covered_files": []
-        }
-
-        # Clean previous coverage data
-        run_command("find . -name '*.gcda' -delete", PROJECT_DIR)
-        
-        # For Coverage, 'make target' is fine as it usually runs the test too or we assume build covers it.
-        # But usually we need to RUN it to get coverage.
-        # If legacy, running 'make test_name' might NOT run it.
-        # Let's force run if legacy.
-
-        if not run_command(test.get('cmd'), PROJECT_DIR):
-            if test.get("type") == "legacy":
-                logging.info(f"[Legacy] Running binary for test: {test.get('name')}")
-                if not run_command(test.get('run_bin'), PROJECT_DIR):
-                    logging.warning(f"Test Build/Run Failed: {test.get('name')}")
-                    test['failed'] = True
-                    commit_results['tests'].append(test)
-                    continue
-            logging.warning(f"Test Build/Run Failed: {test.get('name')}")
-            test['failed'] = True
-            commit_results['tests'].append(test)
-            continue
-        
-        covered = get_covered_files(PROJECT_DIR)
-        test['covered_files'] = covered
-        commit_results['tests'].append(test)
+    with open(tmp_path, "wb") as out, ThreadPoolExecutor(max_workers=workers) as executor:
+        results = executor.map(lambda t: run_coverage_test(t, build_dir, gcov_root, gcov_strip), suite)
+        for i, test in enumerate(results):
+            pb.set(i)
+            out.write(dump_json_line(test))
+            commit_results['tests'].append(summarize(test))
+    os.replace(tmp_path, tests_path)
+
+    shutil.rmtree(gcov_root, ignore_errors=True)
         
     return commit_results
 
-def prepare_for_energy_measurement():
+def get_tests_path(commit, coverage=True):
+    # Versioned: records of an older coverage setup are never read back
+    return os.path.join(CACHE_DIR, f"coverage_v{COVERAGE_CACHE_VERSION}_{commit}_{'cov' if coverage else 'rel'}.jsonl")
+
+def load_commit_tests(commit_results):
+    """
+    Returns the test records of `commit_results` with their covered_files put back
+    from the JSON Lines file written by process_commit.
+
+    :param commit_results: Results of a single commit, as returned by process_commit
+    """
+    tests = commit_results.get('tests', [])
+    tests_path = get_tests_path(commit_results['hash'])
+    if not tests or 'covered_files' in tests[0] or not os.path.exists(tests_path):
+        return tests
+    return [{**full, **test} for full, test in zip(iter_json_lines(tests_path), tests)]
+
+def run_coverage_test(t, cwd, gcov_root, gcov_strip):
+    """
+    Runs a single test with its .gcda output redirected to a private GCOV_PREFIX
+    directory, so several tests can run concurrently against the same build.
+
+    :param t: Test entry as returned by get_openssl_tests
+    :param cwd: The directory holding the coverage build
+    :param gcov_root: Directory under which the per-test GCOV_PREFIX is created
+    :param gcov_strip: GCOV_PREFIX_STRIP value: number of path components of `cwd`
+    :return: The test record with its covered files
+    """
+    test = {
+        "name": t['name'],
+        "failed": False,
+        "cmd": t['cmd'],
+        "covered_files": set()
+    }
+
+    gcov_prefix = os.path.join(gcov_root, t['name'])
+    gcov_env = {
+        "GCOV_PREFIX": gcov_prefix,
+        "GCOV_PREFIX_STRIP": gcov_strip,
+    }
+
+    try:
+        # Paused while the energy phase measures
+        with MEASUREMENT_GATE.coverage_step():
+            # For Coverage, 'make target' is fine as it usually runs the test too or we assume build covers it.
+            # But usually we need to RUN it to get coverage.
+            # If legacy, running 'make test_name' might NOT run it.
+            # Let's force run if legacy.
+
+            # `cmd` stays a string for the energy phase's bash loop; `argv` runs it without a shell
+            if not run_command(t.get('argv') or shlex.split(test.get('cmd')), cwd, env=gcov_env):
+                if test.get("type") == "legacy":
+                    logging.info(f"[Legacy] Running binary for test: {test.get('name')}")
+                    if not run_command([test.get('run_bin')], cwd, env=gcov_env):
+                        logging.warning(f"Test Build/Run Failed: {test.get('name')}")
+                        test['failed'] = True
+                        return test
+                logging.warning(f"Test Build/Run Failed: {test.get('name')}")
+                test['failed'] = True
+                return test
+
+            test['covered_files'] = get_covered_files(gcov_prefix)
+            return test
+    finally:
+        shutil.rmtree(gcov_prefix, ignore_errors=True)
+
+def prepare_for_energy_measurement(cwd):
     """
     Prepare the project for energy measurement.
     Build the project without coverage.
     
-    :param rapl_pkg: Description
-    :param test: Description
-    :param commit: Description
+    :param cwd: The worktree to build
+    :return: The directory holding the build, where the tests must run
     """
     print("\nPreparing project for energy measurement...")
 
-    configure_openssl(PROJECT_DIR, coverage=False)
-    build_openssl(PROJECT_DIR)
+    build_dir = get_build_dir(cwd, coverage=False)
+    configure_openssl(cwd, coverage=False)
+    build_openssl(build_dir, incremental=build_dir != cwd)
+    return build_dir
     
-def run_phase_1_coverage(vuln, fix):
+def run_phase_1_coverage(vuln, fix, git_changed_files=None, worktree_prefix=""):
     """
     Run Phase 1 coverage analysis on a vulnerability and its fix commits.
     This function analyzes test coverage for changed files between a vulnerability
     commit and its corresponding fix commit. It processes both commits by running
-    tests, extracting relevant test coverage, and measuring energy consumption
-    using RAPL (Running Average Power Limit) for each successful test.
+    tests and marking the tests that cover the changed files.
+    On success the worktrees of both commits are left in place for Phase 2.
     Args:
         vuln (str): The git commit hash of the vulnerability commit.
         fix (str): The git commit hash of the fix commit.
+        git_changed_files (set, optional): C/C++ files changed by the fix commit, if
+            already known. Falls back to `git diff-tree` when None.
+        worktree_prefix (str, optional): Prefix of the worktree names of this pair.
     Returns:
         dict or None: A dictionary containing coverage analysis results with the structure:
             {
@@ -335,7 +719,7 @@ def run_phase_1_coverage(vuln, fix):
                     "tests": list
         Returns None if:
         - Checking out the fix commit fails
-        - No changed files are found in git diff
+        - No changed C/C++ files are found in git diff
         - No successful tests exist in either commit
     """
     logging.info(f"--- Phase 1: Coverage {vuln[:8]} -> {fix[:8]} ---")
@@ -359,118 +743,299 @@ def run_phase_1_coverage(vuln, fix):
         }
     }
     
-    clean_repo(PROJECT_DIR)
-    if not run_command(f"git checkout -f {fix}", PROJECT_DIR):
-        logging.error(f"Failed to checkout fix commit: {fix}")
-        return None
-    
-    git_changed_files= get_git_diff_files(PROJECT_DIR, fix)
+    if git_changed_files is None:
+        git_changed_files = get_git_diff_files(PROJECT_DIR, fix, SOURCE_PATHSPECS)
     
+    # Skip the coverage build entirely when the fix touches no C/C++ sources
     if not git_changed_files:
-        logging.error("No target files found in git diff.")
+        logging.error("No C/C++ target files found in git diff.")
         return None
     
-    # FIX COMMIT
-    coverage_results['fix_commit'] = process_commit(fix)
-    if not coverage_results['fix_commit'] or all(t.get('failed', True) for t in coverage_results['fix_commit'].get('tests', [])):
-        logging.error("No successful tests in fix commit. Skipping processing.")
-        return None
-    
-    extract_test_covering_git_changes(coverage_results.get('fix_commit', {}), git_changed_files)
-    logging.info(f"Extracted tests covering changed files in pair ({vuln[:8]}, {fix[:8]}).")
-    
-    logging.info(f"Now computing energy for {fix[:8]}.")
-    
-    # extract RAPL package events
-    rapl_pkg = detect_rapl()
+    worktrees = []
+    succeeded = False
+    try:
+        # FIX COMMIT
+        with MEASUREMENT_GATE.coverage_step():
+            fix_dir = checkout_worktree(fix, worktree_prefix)
+        if not fix_dir:
+            logging.error(f"Failed to checkout fix commit: {fix}")
+            return None
+        worktrees.append(fix_dir)
+
+        coverage_results['fix_commit'] = process_commit(fix, fix_dir, changed_files=git_changed_files)
+        if not coverage_results['fix_commit'] or all(t.get('failed', True) for t in coverage_results['fix_commit'].get('tests', [])):
+            logging.error("No successful tests in fix commit. Skipping processing.")
+            return None
+        
+        extract_test_covering_git_changes(coverage_results.get('fix_commit', {}), git_changed_files)
+        logging.info(f"Extracted tests covering changed files in pair ({vuln[:8]}, {fix[:8]}).")
 
-    kept_tests = [t for t in coverage_results['fix_commit'].get('tests', []) if t.get('keep', True) and not t.get('failed', True)]
+        # Nothing to measure for this pair: spare the vuln build and the energy phase
+        if not any(t.get('keep', False) for t in coverage_results['fix_commit']['tests']):
+            logging.error(f"No test of {fix[:8]} covers the changed files. Skipping processing.")
+            return None
 
-    prepare_for_energy_measurement()
-    for test in kept_tests:
-        measure_test(rapl_pkg, test, fix)
+        # VULN COMMIT
+        with MEASUREMENT_GATE.coverage_step():
+            vuln_dir = checkout_worktree(vuln, worktree_prefix)
+        if not vuln_dir:
+            logging.error(f"Failed to checkout vuln commit: {vuln}")
+            return None
+        worktrees.append(vuln_dir)
 
-    # VULN COMMIT
-    coverage_results['vuln_commit'] = process_commit(vuln)
-    if not coverage_results['vuln_commit'] or all(t.get('failed', True) for t in coverage_results['vuln_commit'].get('tests', [])):
-        logging.error("No successful tests in vuln commit. Skipping processing.")
-        return None
+        coverage_results['vuln_commit'] = process_commit(vuln, vuln_dir, changed_files=git_changed_files)
+        if not coverage_results['vuln_commit'] or all(t.get('failed', True) for t in coverage_results['vuln_commit'].get('tests', [])):
+            logging.error("No successful tests in vuln commit. Skipping processing.")
+            return None
 
-    logging.info(f"{vuln[:8]} completed.")
+        logging.info(f"{vuln[:8]} completed.")
 
-    extract_test_covering_git_changes(coverage_results.get('vuln_commit', {}), git_changed_files)
-    logging.info(f"Extracted tests covering changed files in pair ({vuln[:8]}, {fix[:8]}).")
-    logging.info(f"Now computing energy for {vuln[:8]}.")
-    
-    kept_tests = [t for t in coverage_results.get('vuln_commit', {}).get('tests', []) if t.get('keep', True) and not t.get('failed', True)]
-    
-    prepare_for_energy_measurement()
-    for test in kept_tests:
-        measure_test(rapl_pkg, test, vuln)
+        extract_test_covering_git_changes(coverage_results.get('vuln_commit', {}), git_changed_files)
+        logging.info(f"Extracted tests covering changed files in pair ({vuln[:8]}, {fix[:8]}).")
+
+        succeeded = True
+        return coverage_results
+    finally:
+        if not succeeded:
+            for worktree in worktrees:
+                remove_worktree(worktree)
+
+def iter_phase_1_coverage(pairs, changed_by_commit, total, workers=1):
+    """
+    Yields (i, vuln, fix, coverage_results) for every pair, in order, running Phase 1 lazily.
+    Each pair gets its own worktrees, named after its index `i`, so with `workers` > 1
+    up to that many pairs are covered concurrently.
+
+    :param pairs: List of (vuln, fix) commit pairs
+    :param changed_by_commit: Changed C/C++ files keyed by fix commit
+    :param total: Number of pairs reported in the progress message
+    :param workers: Number of pairs covered at the same time
+    """
+    def cover(i, vuln, fix):
+        print(f"\n[{i+1}/{total}] Processing Pair: {vuln[:8]} -> {fix[:8]}")
+        return i, vuln, fix, run_phase_1_coverage(vuln, fix, changed_by_commit.get(fix), f"{i}-")
+
+    if workers <= 1:
+        for i, (vuln, fix) in enumerate(pairs):
+            yield cover(i, vuln, fix)
+        return
+
+    # Sliding window: never more than `workers` pairs in flight, results in input order
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        pending = deque()
+        for i, (vuln, fix) in enumerate(pairs):
+            pending.append(executor.submit(cover, i, vuln, fix))
+            if len(pending) >= workers:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+def coverage_producer(coverage_iter, out_queue):
+    """
+    Runs Phase 1 on COVERAGE_CORES and hands each result to the energy phase.
+    A None item marks the end of the stream, also when Phase 1 raises.
+
+    :param coverage_iter: Iterator returned by iter_phase_1_coverage
+    :param out_queue: Queue consumed by the energy phase
+    """
+    pin_current_thread(COVERAGE_CORES)
+    try:
+        for item in coverage_iter:
+            out_queue.put(item)
+    except Exception as e:
+        logging.error(f"Coverage phase aborted: {e}")
+    finally:
+        out_queue.put(None)
 
-    return coverage_results
+def run_phase_2_energy(coverage_results, rapl_pkg, worktree_prefix=""):
+    """
+    Run Phase 2 on a pair processed by run_phase_1_coverage: rebuild both commits
+    without coverage and measure the energy of their kept tests using RAPL
+    (Running Average Power Limit). The worktrees are removed afterwards.
+
+    :param coverage_results: Results returned by run_phase_1_coverage
+    :param rapl_pkg: RAPL events as returned by detect_rapl
+    :param worktree_prefix: Prefix passed to run_phase_1_coverage for this pair
+    """
+    vuln = coverage_results['vuln_commit']['hash']
+    fix = coverage_results['fix_commit']['hash']
+    for key in ("fix_commit", "vuln_commit"):
+        commit = coverage_results[key]['hash']
+        logging.info(f"Now computing energy for {commit[:8]}.")
+
+        commit_dir = checkout_worktree(commit, worktree_prefix)
+        if not commit_dir:
+            logging.error(f"Failed to checkout commit: {commit}")
+            continue
+
+        try:
+            kept_tests = [t for t in coverage_results[key].get('tests', []) if t.get('keep', False) and not t.get('failed', True)]
+
+            energy_dir = prepare_for_energy_measurement(commit_dir)
+            # The build above overlaps the coverage phase, the measurements never do
+            with MEASUREMENT_GATE.measuring(), MeasurementWriter(vuln, fix, commit) as writer:
+                for test in kept_tests:
+                    measure_test(rapl_pkg, test, writer, energy_dir)
+        finally:
+            remove_worktree(commit_dir)
     
 def extract_test_covering_git_changes(coverage_results, target_files):  
     """
-    Mark "keep" in tests that cover changed files. 
+    Mark "keep" in tests that cover at least one changed file. 
     
-    :param coverage_results: Description
-    :param target_files: Description
+    :param coverage_results: Results of a single commit, as returned by process_commit
+    :param target_files: Changed source files of the fix commit
     """
+    if coverage_results.get('failed', {}).get('status', False):
+        return
 
-    for target in target_files:
-        for test in coverage_results.get('tests', []):
-            if coverage_results.get('failed', {}).get('status', True):
-                continue
-        
-            for test in coverage_results.get('tests', []):
-                covered_files = test.get('covered_files', [])
-                test['keep'] = target in covered_files
+    targets = frozenset(target_files)
+    for test in coverage_results.get('tests', []):
+        # Tests streamed by process_commit were already marked without their covered_files
+        if 'covered_files' in test:
+            test['keep'] = not targets.isdisjoint(test['covered_files'])
 
 
 # ==========================================
 # PHASE 2: ENERGY
 # ==========================================
+def get_rapl_cache_key():
+    # RAPL domains depend on the CPU and on the kernel's perf support, not on the container
+    model = ""
+    try:
+        with open("/proc/cpuinfo", 'r') as f:
+            for line in f:
+                if line.startswith("model name"):
+                    model = line.split(":", 1)[1].strip()
+                    break
+    except OSError:
+        pass
+    return f"{platform.release()}|{model}"
+
+@functools.lru_cache(maxsize=1)
 def detect_rapl(perf_bin="perf"):
+    """
+    Returns the RAPL energy events `perf` offers on this machine.
+    The result never changes for a given CPU and kernel, so it is memoized in
+    process and persisted in RAPL_CACHE for later runs.
+    """
+    key = get_rapl_cache_key()
+    cached = load_json(RAPL_CACHE).get(key)
+    if cached:
+        return cached
+
     # --no-desc makes output easier to parse if supported; if not, fall back.
-    cmd = [perf_bin, "list", "--no-desc"]
-    try:
-        out = subprocess.check_output(cmd, text=True, stderr=subprocess.STDOUT)
-    except subprocess.CalledProcessError:
-        out = subprocess.check_output([perf_bin, "list"], text=True, stderr=subprocess.STDOUT)
+    events, ok = _scan_perf_list([perf_bin, "list", "--no-desc"])
+    if not ok:
+        events, _ = _scan_perf_list([perf_bin, "list"])
 
-    events = set()
-    for line in out.splitlines():
-        # Grab all matches from the line (some lines may include multiple tokens)
-        for m in ENERGY_RE.findall(line):
-            # Normalize to the canonical perf selector form with trailing '/'
-            if not m.endswith("/"):
-                m += "/"
-            events.add(m)
+    events = sorted(events)
+    if events:
+        rapl_cache = load_json(RAPL_CACHE)
+        rapl_cache[key] = events
+        save_json(RAPL_CACHE, rapl_cache)
+    return events
 
-    return sorted(events)
 
+class MeasurementWriter:
+    """
+    Writes every measured window of a commit's tests to
+    PERF_DIR/<vuln>_<fix>_<commit>_energy.bin as fixed-size MEASUREMENT_RECORD rows,
+    instead of writing one CSV per test. The file is named after the pair too: a
+    commit shared by several pairs is measured once per pair, each time for the
+    tests kept for that pair's changed files.
+    Test and event names are stored once, in the .json sidecar of the same name,
+    in the order of the indices used by the records. The file loads with
+    numpy.fromfile(path, dtype=[('test', '<u4'), ('event', '<u4'), ('time_ns', '<i8'), ('value', '<f8')]).
+    """
+    __slots__ = ('path', 'tests', 'events', '_file')
+
+    def __init__(self, vuln, fix, commit):
+        self.path = os.path.join(PERF_DIR, f"{vuln[:8]}_{fix[:8]}_{commit}_energy.bin")
+        self.tests = []
+        self.events = {}
+        self._file = open(self.path, 'wb')
+
+    def append(self, test_name, rows):
+        """
+        :param test_name: Name of the measured test
+        :param rows: Iterable of (seconds since start, value, event name)
+        """
+        test_id = len(self.tests)
+        self.tests.append(test_name)
+        buf = bytearray()
+        for seconds, value, event in rows:
+            event_id = self.events.setdefault(event, len(self.events))
+            buf += MEASUREMENT_RECORD.pack(test_id, event_id, round(seconds * 1e9), value)
+        self._file.write(buf)
+
+    def close(self):
+        self._file.close()
+        save_json(self.path[:-len(".bin")] + ".json", {"tests": self.tests, "events": list(self.events)})
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+def parse_perf_intervals(output, hw_cpu=None):
+    """
+    Yields (seconds, value, event) from `perf stat -I -x,` output.
+    Counters perf could not read (<not counted>, <not supported>) yield NaN.
+    With `hw_cpu`, the output is per CPU (`-A`, a CPU column after the timestamp):
+    energy events are summed over the CPUs they were read on, the other events
+    are kept for `hw_cpu` only.
+    """
+    per_cpu = {}
+    for line in output.splitlines():
+        if not line or line.startswith('#'):
+            continue
+        fields = line.split(',')
+        cpu = fields.pop(1) if hw_cpu is not None and len(fields) > 1 else None
+        if len(fields) < 4:
+            continue
+        try:
+            seconds = float(fields[0])
+        except ValueError:
+            continue
+        try:
+            value = float(fields[1])
+        except ValueError:
+            value = float('nan')
+        event = fields[3]
+        if hw_cpu is None:
+            yield seconds, value, event
+        elif event.startswith("power/"):
+            per_cpu[seconds, event] = per_cpu.get((seconds, event), 0.0) + value
+        elif cpu == f"CPU{hw_cpu}":
+            per_cpu[seconds, event] = value
+    for (seconds, event), value in per_cpu.items():
+        yield seconds, value, event
 
 def _wrap_until_timeout(test_cmd: str, timeout_ms: int) -> str:
     """
     Returns a bash command that runs `test_cmd` repeatedly until timeout expires.
-    - uses monotonic-ish wall clock via SECONDS (bash built-in, second resolution)
+    - uses the wall clock via EPOCHREALTIME (bash >= 5, microsecond resolution),
+      so windows shorter than a second work too
     - avoids killing a running iteration mid-command (it checks deadline BETWEEN iterations)
     """
-    # Use bash -lc so we can rely on bash features and keep quoting predictable
-    # SECONDS is integer seconds since shell start; good enough for energy runs (>= 2-5s).
-    timeout_s = max(1, int((timeout_ms + 999) / 1000))  # ceil to seconds
+    # Use bash -c (not a login shell) so we get bash features without sourcing
+    # /etc/profile and ~/.profile on every measurement.
+    # EPOCHREALTIME is "seconds.micros" (the separator follows the locale); dropping
+    # the separator gives an integer count of microseconds.
+    timeout_us = max(1, int(timeout_ms)) * 1000
 
     # Important:
     # - `set -e` makes failures stop the loop and propagate non-zero to perf (you want this)
     # - you can change to `|| true` if you prefer "keep looping even if one iteration fails"
     wrapped = (
-        "bash -lc "
+        "bash -c "
         + shlex.quote(
             f"""
             set -e
-            end=$((SECONDS + {timeout_s}))
-            while [ $SECONDS -lt $end ]; do
+            end=$(( ${{EPOCHREALTIME/[.,]/}} + {timeout_us} ))
+            while (( ${{EPOCHREALTIME/[.,]/}} < end )); do
               {test_cmd}
             done
             """
@@ -478,7 +1043,157 @@ def _wrap_until_timeout(test_cmd: str, timeout_ms: int) -> str:
     )
     return wrapped
 
-def measure_test(pkg_event, test, commit):#, core_event):
+def get_powercap_zones():
+    """
+    Returns (name, energy_uj path, max_energy_range_uj) for every readable RAPL
+    zone under POWERCAP_DIR, or an empty list (no RAPL, or not running as root).
+    """
+    zones = []
+    try:
+        entries = sorted(e for e in os.listdir(POWERCAP_DIR) if e.startswith("intel-rapl:"))
+    except OSError:
+        return zones
+    for entry in entries:
+        zone = os.path.join(POWERCAP_DIR, entry)
+        energy = os.path.join(zone, "energy_uj")
+        try:
+            with open(os.path.join(zone, "name"), 'r') as f:
+                name = f.read().strip()
+            with open(os.path.join(zone, "max_energy_range_uj"), 'r') as f:
+                max_uj = int(f.read())
+            with open(energy, 'r') as f:
+                int(f.read())
+        except (OSError, ValueError):
+            continue
+        zones.append((name, energy, max_uj))
+    return zones
+
+@functools.lru_cache(maxsize=1)
+def get_rapl_cpus():
+    """
+    Returns the CPUs the RAPL PMU can be read from (one per package), as listed
+    in its sysfs cpumask (e.g. "0,28" or "0-1"), or an empty set.
+    """
+    cpus = set()
+    try:
+        with open(RAPL_PMU_CPUMASK, 'r') as f:
+            mask = f.read().strip()
+    except OSError:
+        return frozenset()
+    for part in filter(None, mask.split(',')):
+        first, _, last = part.partition('-')
+        cpus.update(range(int(first), int(last or first) + 1))
+    return frozenset(cpus)
+
+def _pin_to_measure_cpu(argv):
+    # Keep the measured test off the other cores, away from the coverage phase
+    if MEASURE_CPU is None:
+        return argv
+    return ["taskset", "-c", str(MEASURE_CPU), *argv]
+
+def _read_energy_uj(fds):
+    # pread at offset 0 makes sysfs regenerate the value on an already open fd
+    return [int(os.pread(fd, 32, 0)) for fd in fds]
+
+def measure_with_powercap(zones, test_cmd, timeout_ms, cwd):
+    """
+    Runs ITERATIONS windows of `test_cmd` (each looping for `timeout_ms`).
+    Returns the CompletedProcess of the last window and the energy of every window
+    as (seconds, joules, event) rows. When a window fails, its CompletedProcess is
+    returned with no rows; with no window at all (ITERATIONS == 0), (None, []).
+
+    :param zones: RAPL zones as returned by get_powercap_zones
+    """
+    wrapped_cmd = _wrap_until_timeout(test_cmd, timeout_ms)
+    res, rows = None, []
+    # Open every counter once; each window then costs one pread per zone
+    fds = [os.open(energy, os.O_RDONLY) for _, energy, _ in zones]
+    try:
+        start = time.monotonic()
+        for _ in range(ITERATIONS):
+            before = _read_energy_uj(fds)
+            res = subprocess.run(_pin_to_measure_cpu(shlex.split(wrapped_cmd)), cwd=cwd,
+                                 stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True)
+            after = _read_energy_uj(fds)
+            if res.returncode != 0:
+                return res, []
+            elapsed = time.monotonic() - start
+            for (name, _, max_uj), b, a in zip(zones, before, after):
+                # energy_uj wraps around at max_energy_range_uj
+                delta = a - b if a >= b else a + max_uj - b
+                rows.append((elapsed, delta / 1e6, f"powercap/{name}/"))
+    finally:
+        for fd in fds:
+            os.close(fd)
+    return res, rows
+
+def run_perf_stat(perf_events, test_cmd, timeout_ms, cwd):
+    """
+    Measures `test_cmd` with perf and returns the CompletedProcess and the
+    (seconds, value, event) rows of the first ITERATIONS intervals.
+    """
+    # A single perf session covers all iterations: `-I timeout_ms` makes perf emit
+    # one row per event and per iteration window (first column is the interval
+    # timestamp), so counters are set up once per test.
+    wrapped_cmd = _wrap_until_timeout(test_cmd, timeout_ms * ITERATIONS)
+    # perf writes its rows to an anonymous in-memory file: no file created per test
+    log_fd = os.memfd_create("perf-stat")
+
+    # Counting on MEASURE_CPU only keeps other processes out of cycles/instructions.
+    # RAPL counters are per package and perf opens them on the PMU's own CPUs (its
+    # cpumask, usually CPU 0). When MEASURE_CPU is not one of them the session also
+    # covers those CPUs, reported per CPU (-A), and parse_perf_intervals keeps the
+    # energy of the RAPL CPUs and the cycles/instructions of MEASURE_CPU.
+    # An unpinned test (no taskset) is counted on every CPU.
+    rapl_cpus = get_rapl_cpus()
+    hw_cpu = None
+    if MEASURE_CPU is None:
+        cpu_args = ["-a"]
+    elif MEASURE_CPU in rapl_cpus or not rapl_cpus:
+        cpu_args = ["-C", str(MEASURE_CPU)]
+    else:
+        cpu_args = ["-C", ",".join(map(str, sorted(rapl_cpus | {MEASURE_CPU}))), "-A"]
+        hw_cpu = MEASURE_CPU
+
+    # Build perf as argv list (safer than huge shell string)
+    perf_argv = [
+        "perf", "stat",
+        *cpu_args,
+        "-e", f"{perf_events}",
+        "-I", str(timeout_ms),
+        "-x,", "--log-fd", str(log_fd),
+        "--",
+    ]
+    # wrapped_cmd is "bash -c '<script>'": split it so perf starts bash directly,
+    # without an extra sh in front of it
+    perf_argv += _pin_to_measure_cpu(shlex.split(wrapped_cmd))
+
+    try:
+        res = subprocess.run(
+            perf_argv, 
+            cwd=cwd, 
+            # The test's own output is not needed, only perf's rows and the errors
+            stdout=subprocess.DEVNULL, 
+            stderr=subprocess.PIPE, 
+            text=True,
+            pass_fds=(log_fd,))
+        os.lseek(log_fd, 0, os.SEEK_SET)
+        with os.fdopen(os.dup(log_fd), 'r') as f:
+            output = f.read()
+    finally:
+        os.close(log_fd)
+
+    # The loop only checks its deadline between test runs, so it overruns the last
+    # window and perf flushes one more, truncated interval when it exits: only the
+    # first ITERATIONS intervals of every event are full windows
+    rows, seen = [], {}
+    for row in parse_perf_intervals(output, hw_cpu):
+        n = seen[row[2]] = seen.get(row[2], 0) + 1
+        if n <= ITERATIONS:
+            rows.append(row)
+    return res, rows
+
+def measure_test(pkg_event, test, writer, cwd=PROJECT_DIR):#, core_event):
     # Accept a list from detect_rapl() or a single event string.
     if isinstance(pkg_event, (list, tuple, set)):
         events = [str(e).strip() for e in pkg_event if str(e).strip()]
@@ -490,52 +1205,36 @@ def measure_test(pkg_event, test, commit):#, core_event):
     if not events:
         events = ["power/energy-pkg/"]
 
-    perf_events = ",".join(events + ["cycles", "instructions"])
+    # cycles and instructions form one event group, so they are always scheduled
+    # together and their ratio stays exact even if the PMU has to multiplex.
+    # (No `:G` modifier: for perf that means "count in guest only", not "group".)
+    perf_events = ",".join(events + ["{cycles,instructions}"])
     
-    pb = ProgressBar(ITERATIONS)
-    perf_dir = os.path.join(OUTPUT_DIR, REPO_NAME, "perf")
-    os.makedirs(perf_dir, exist_ok=True)
-
     timeout_ms = test.get("timeout_ms", DEFAULT_TIMEOUT_MS)  # e.g. 5s default, tune per test
     print(f"\nMeasuring energy for test '{test.get('name')}': "
           f"{ITERATIONS} iterations × {timeout_ms}ms timeout each")
 
-    for iteration in range(ITERATIONS):
-        pb.set(iteration)
-
-        perf_out = os.path.join(perf_dir, f"{commit}_{test.get('name')}__{iteration}.csv")
-
-        wrapped_cmd = _wrap_until_timeout(test["cmd"], timeout_ms)
+    # powercap when asked for and readable, perf otherwise
+    zones = get_powercap_zones() if POWERCAP_ONLY else []
+    if zones:
+        res, rows = measure_with_powercap(zones, test["cmd"], timeout_ms, cwd)
+    else:
+        res, rows = run_perf_stat(perf_events, test["cmd"], timeout_ms, cwd)
+    
+    if res is None:
+        logging.error(f"No measurement window ran for {test.get('name')} (ITERATIONS = {ITERATIONS}).")
+        return None
 
-        # Build perf as argv list (safer than huge shell string)
-        perf_argv = [
-            "perf", "stat",
-            "-a",
-            "-e", f"{perf_events}",
-            "-x,", "--output", perf_out,
-            "--",
-        ]
-        # wrapped_cmd already includes "bash -lc '<script>'" so we run via sh -c? Not needed.
-        # But since wrapped_cmd is a single string, we can still do: ["sh","-c", wrapped_cmd]
-        perf_argv += ["sh", "-c", wrapped_cmd]
+    if res.returncode != 0: 
+        print(f"\n[ERROR] Test {test.get('name')} failed during energy measurement. {res.stderr.strip()}")
+        logging.error(f"[STD ERR] {test.get('name')}: {res.stderr}")
+        logging.error(f"Perf Measurement discarded due to error.")
+        return None
 
-        res = subprocess.run(
-            perf_argv, 
-            cwd=PROJECT_DIR, 
-            stdout=subprocess.PIPE, 
-            stderr=subprocess.PIPE, 
-            text=True)
-        
-        if res.returncode != 0: 
-            print(f"\n[ERROR] Test {test.get('name')} failed during energy measurement. {res.stderr.strip()}")
-            logging.error(f"[STD ERR] {test.get('name')}: {res.stderr}")
-            if os.path.exists(perf_out):
-                os.remove(perf_out)
-            logging.error(f"Perf Measurement removed due to error.")
-            return None
-        
-        logging.info(f"[COOL DOWN] {COOL_DOWN_TO_SEC} seconds...")
-        time.sleep(COOL_DOWN_TO_SEC)
+    writer.append(test.get('name'), rows)
+    
+    logging.info(f"[COOL DOWN] {COOL_DOWN_TO_SEC} seconds...")
+    time.sleep(COOL_DOWN_TO_SEC)
         
     return None
 
@@ -545,7 +1244,7 @@ def read_configuration():
         try:
             with open(config_file, 'r') as f:
                 logging.info(f"Configuration loaded from {config_file}")
-                return yaml.safe_load(f)
+                return yaml.load(f, Loader=YAML_LOADER)
         except Exception as e:
             logging.error(f"Error reading configuration file: {e}")
     else:
@@ -558,30 +1257,64 @@ def main():
     prepare_directories()
     setup_logging()
     download_csv_if_missing()
+    setup_ccache()
 
     read_configuration() 
 
     pairs = []
     try:
-        with open(INPUT_CSV, 'r') as f:
-            reader = csv.DictReader(f)
-            for row in reader:
-                if row.get('project') == REPO_NAME and 'vuln_commit' in row and 'fix_commit' in row:
-                    pairs.append((row['vuln_commit'], row['fix_commit']))
+        with open(INPUT_CSV, 'r', newline='', buffering=1 << 20) as f:
+            # Plain csv.reader + header index map: no dict allocated per row
+            reader = csv.reader(f)
+            idx = {name: i for i, name in enumerate(next(reader, []))}
+            if 'project' in idx and 'vuln_commit' in idx and 'fix_commit' in idx:
+                p_i, v_i, f_i = idx['project'], idx['vuln_commit'], idx['fix_commit']
+                min_len = max(p_i, v_i, f_i) + 1
+                for row in reader:
+                    if len(row) >= min_len and row[p_i] == REPO_NAME:
+                        pairs.append((row[v_i], row[f_i]))
     except Exception as e:
         sys.exit(1)
 
-    for i, (vuln, fix) in enumerate(pairs[:10]):
-        print(f"\n[{i+1}/{len(pairs)}] Processing Pair: {vuln[:8]} -> {fix[:8]}")
-        
-        coverage_dict = run_phase_1_coverage(vuln, fix)
+    # extract RAPL package events once; they are the same for every pair.
+    # `perf list` runs in the background while the first pairs are covered,
+    # only Phase 2 waits for it
+    setup_executor = ThreadPoolExecutor(max_workers=1)
+    rapl_future = setup_executor.submit(detect_rapl)
+    setup_executor.shutdown(wait=False)
+
+    # Resolve the changed C/C++ files of every fix commit with a single git process;
+    # keyed by commit so a fix shared by several pairs is only resolved once.
+    # Fixes touching no C/C++ file are absent and fall back to get_git_diff_files.
+    changed_by_commit = dict(iter_commits_files(PROJECT_DIR, {fix for _, fix in pairs[:10]}, SOURCE_PATHSPECS))
+
+    if PIPELINE_PHASES and len(AVAILABLE_CORES) > 1:
+        coverage_iter = iter_phase_1_coverage(pairs[:10], changed_by_commit, len(pairs), COVERAGE_PAIR_WORKERS)
+        # Only a bounded number of covered pairs wait for the energy phase,
+        # bounding the number of worktrees on disk
+        coverage_queue = queue.Queue(maxsize=1)
+        threading.Thread(target=coverage_producer, args=(coverage_iter, coverage_queue), daemon=True).start()
+        # This thread stays unpinned, so the release builds of Phase 2 use every core;
+        # only the measured commands are pinned to MEASURE_CPU (see _pin_to_measure_cpu)
+        coverage_iter = iter(coverage_queue.get, None)
+    else:
+        coverage_iter = iter_phase_1_coverage(pairs[:10], changed_by_commit, len(pairs))
+
+    for i, vuln, fix, coverage_dict in coverage_iter:
         if coverage_dict is None:
             print(f"\nSkipping Phase 2 due to Phase 1 failure for pair {vuln[:8]} -> {fix[:8]}")
             continue
 
+        run_phase_2_energy(coverage_dict, rapl_future.result(), f"{i}-")
+
+        # covered_files only live in the per-commit JSON Lines files until now
+        for key in ("fix_commit", "vuln_commit"):
+            coverage_dict[key] = {**coverage_dict[key], "tests": load_commit_tests(coverage_dict[key])}
+
         coverage_path = os.path.join(OUTPUT_DIR, f"{REPO_NAME}_{vuln[:8]}_{fix[:8]}_coverage.json")
-        with open(coverage_path, "w") as f:
-                json.dump(coverage_dict, f, indent=2)
+        # Serialize in memory and hand the bytes to a single write
+        with open(coverage_path, "wb") as f:
+            f.write(dump_json_bytes(coverage_dict))
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -7,7 +7,6 @@ import time
 import math
 import sys
 import urllib.request
-import glob
 
 # ==========================================
 # CONFIGURATION
@@ -16,6 +15,11 @@ REPO_NAME = "tcpdump"
 TARGET_DURATION_SEC = 2.0
 CSV_WRITE_INTERVAL = 50
 TEST_LIMIT = None
+NPROC = os.cpu_count() or 1
+# -l keeps make from starting new jobs while the load is above the core count
+BUILD_CMD = ["make", f"-j{NPROC}", f"-l{NPROC}"]
+CONFIGURE_COV = "./configure CFLAGS='-fprofile-arcs -ftest-coverage -g -O0' LDFLAGS='-fprofile-arcs -ftest-coverage'"
+CONFIGURE_REL = "./configure"
 
 GIST_CSV_URL = "https://gist.githubusercontent.com/waheed-sep/935cfc1ba42b2475d45336a4c779cbc8/raw/ea91568360d87979373a7eca38f289c9bf30d103/cwe_projects.csv"
 
@@ -46,8 +50,8 @@ def run_command(command, cwd, ignore_errors=False):
     try:
         env = os.environ.copy()
         env["LC_ALL"] = "C"
-        result = subprocess.run(command, cwd=cwd, shell=True, env=env,
-                                stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True)
+        result = subprocess.run(command, cwd=cwd, shell=isinstance(command, str), env=env,
+                                stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, universal_newlines=True)
         if result.returncode != 0 and not ignore_errors:
             logging.error(f"FAIL: {command}\nSTDERR: {result.stderr.strip()}")
             return False
@@ -86,23 +90,40 @@ def download_csv_if_missing():
             print(f"Error downloading CSV: {e}")
             sys.exit(1)
 
+def build_commit(commit, coverage):
+    """
+    Checks `commit` out in PROJECT_DIR from a clean tree and builds it,
+    instrumented for gcov when `coverage` is set.
+    """
+    clean_repo(PROJECT_DIR)
+    run_command(f"git checkout -f {commit}", PROJECT_DIR)
+    # clean_repo's `git clean -fdx` already removed every object, no `make clean` needed
+    run_command(CONFIGURE_COV if coverage else CONFIGURE_REL, PROJECT_DIR)
+    return run_command(BUILD_CMD, PROJECT_DIR)
+
 def get_git_diff_files(cwd, commit_hash):
-    cmd = f"git diff-tree --no-commit-id --name-only -r {commit_hash}"
-    result = subprocess.run(cmd, cwd=cwd, shell=True, stdout=subprocess.PIPE, text=True)
+    cmd = ["git", "diff-tree", "--no-commit-id", "--name-only", "-r", commit_hash]
+    result = subprocess.run(cmd, cwd=cwd, stdout=subprocess.PIPE, text=True)
     return {f for f in result.stdout.strip().split('\n') if f}
 
 def get_covered_files(cwd):
     covered = set()
-    for root, dirs, files in os.walk(cwd):
+    skip = len(os.path.join(cwd, ""))
+    for root, dirs, files, dirfd in os.fwalk(cwd):
+        prefix = root[skip:] + os.sep if len(root) > skip else ""
+        for file in files:
+            if file.endswith(".gcda"):
+                covered.add(prefix + file[:-5] + ".c")
+    return covered
+
+def purge_gcda_files(cwd):
+    for root, dirs, files, dirfd in os.fwalk(cwd):
         for file in files:
             if file.endswith(".gcda"):
-                source_name = file.replace(".gcda", ".c")
-                rel_dir = os.path.relpath(root, cwd)
-                full_path = source_name if rel_dir == "." else os.path.join(rel_dir, source_name)
-                if full_path.startswith("./"):
-                    full_path = full_path[2:]
-                covered.add(full_path)
-    return list(covered)
+                try:
+                    os.unlink(file, dir_fd=dirfd)
+                except FileNotFoundError:
+                    pass
 
 def flush_buffer_to_csv(filepath, buffer, fieldnames):
     if not buffer: return
@@ -172,9 +193,10 @@ def get_tcpdump_tests(cwd):
     else:
         logging.info("TESTLIST missing. Scanning .pcap files...")
         try:
-            pcap_files = glob.glob(os.path.join(tests_dir, "*.pcap"))
-            for pcap in pcap_files:
-                t_name = os.path.splitext(os.path.basename(pcap))[0]
+            # Reuses the listing made for the runner detection
+            for pcap in files:
+                if not pcap.endswith(".pcap"): continue
+                t_name = pcap[:-len(".pcap")]
                 tests.append({
                     "name": t_name,
                     "cmd": f"(cd tests && TCPDUMP=../tcpdump {runner_script} {t_name})"
@@ -213,12 +235,7 @@ def run_phase_1_coverage(vuln, fix, master_csv_path, checkpoint_path):
     # A. VULN COMMIT
     if cached_data.get("status") != "COMPLETE":
         logging.info(f"Building Vuln {vuln} (Coverage)...")
-        clean_repo(PROJECT_DIR)
-        run_command(f"git checkout -f {vuln}", PROJECT_DIR)
-        
-        run_command("./configure CFLAGS='-fprofile-arcs -ftest-coverage -g -O0' LDFLAGS='-fprofile-arcs -ftest-coverage'", PROJECT_DIR)
-        run_command("make clean", PROJECT_DIR)
-        run_command("make -j$(nproc)", PROJECT_DIR)
+        build_commit(vuln, coverage=True)
         
         suite = get_tcpdump_tests(PROJECT_DIR)
         print(f"Running {len(suite)} tests for Vuln Commit...")
@@ -229,7 +246,7 @@ def run_phase_1_coverage(vuln, fix, master_csv_path, checkpoint_path):
             
             if i % 20 == 0: print(f"  [P1-Vuln] {i}/{len(suite)}: {t_name}")
             
-            run_command("find . -name '*.gcda' -delete", PROJECT_DIR)
+            purge_gcda_files(PROJECT_DIR)
             run_command(test['cmd'], PROJECT_DIR, ignore_errors=True)
             
             covered = get_covered_files(PROJECT_DIR)
@@ -243,12 +260,7 @@ def run_phase_1_coverage(vuln, fix, master_csv_path, checkpoint_path):
 
     # B. FIX COMMIT
     logging.info(f"Building Fix {fix} (Coverage)...")
-    clean_repo(PROJECT_DIR)
-    run_command(f"git checkout -f {fix}", PROJECT_DIR)
-    
-    run_command("./configure CFLAGS='-fprofile-arcs -ftest-coverage -g -O0' LDFLAGS='-fprofile-arcs -ftest-coverage'", PROJECT_DIR)
-    run_command("make clean", PROJECT_DIR)
-    run_command("make -j$(nproc)", PROJECT_DIR)
+    build_commit(fix, coverage=True)
 
     suite = get_tcpdump_tests(PROJECT_DIR)
     csv_buffer = []
@@ -259,13 +271,15 @@ def run_phase_1_coverage(vuln, fix, master_csv_path, checkpoint_path):
         t_name = test['name']
         if i % 20 == 0: print(f"  [P1-Fix] {i}/{len(suite)}: {t_name}")
 
-        run_command("find . -name '*.gcda' -delete", PROJECT_DIR)
+        purge_gcda_files(PROJECT_DIR)
         run_command(test['cmd'], PROJECT_DIR, ignore_errors=True)
         
         covered = get_covered_files(PROJECT_DIR)
         
+        # Look-ups below are set membership tests, not list scans
+        v_files = set(vuln_results.get(t_name, ()))
         for target in target_files:
-            v_covered = (t_name in vuln_results) and (target in vuln_results[t_name])
+            v_covered = target in v_files
             f_covered = target in covered
 
             if v_covered or f_covered:
@@ -364,12 +378,7 @@ def run_phase_2_energy(master_p1_csv, master_p2_csv, checkpoint_path, current_vu
         if not todos: continue
         
         logging.info(f"Building {commit} (Standard)...")
-        clean_repo(PROJECT_DIR)
-        run_command(f"git checkout -f {commit}", PROJECT_DIR)
-        
-        run_command("./configure", PROJECT_DIR)
-        run_command("make clean", PROJECT_DIR)
-        run_command("make -j$(nproc)", PROJECT_DIR)
+        build_commit(commit, coverage=False)
 
         # Get exact commands
         suite = get_tcpdump_tests(PROJECT_DIR)
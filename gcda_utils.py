@@ -0,0 +1,37 @@
+import os
+
+# Helpers for the .gcda files gcc writes next to every instrumented object,
+# shared by the curl and vuln/fix coverage scripts
+
+def iter_gcda_files(root, skip_hidden=False):
+    """
+    Yields (rel_dir, entry) for every .gcda file under root, where rel_dir is the
+    entry's directory relative to root with a trailing "/" ("" for root itself).
+    A single os.scandir walk with an explicit stack: DirEntry carries the d_type,
+    so no entry needs a stat, and rel_dir is carried down instead of using relpath.
+
+    :param root: Root of the build tree
+    :param skip_hidden: Skip every hidden directory (as glob's ** does), not just .git
+    """
+    stack = [(root, "")]
+    while stack:
+        path, rel = stack.pop()
+        try:
+            it = os.scandir(path)
+        except OSError:
+            continue
+        with it:
+            for entry in it:
+                if entry.is_dir(follow_symlinks=False):
+                    if entry.name != ".git" and not (skip_hidden and entry.name.startswith('.')):
+                        stack.append((entry.path, rel + entry.name + "/"))
+                elif entry.name.endswith(".gcda"):
+                    yield rel, entry
+
+def purge_gcda_files(root):
+    """Deletes the .gcda files left by the previous test, in-process instead of forking `find`."""
+    for _, entry in iter_gcda_files(root):
+        try:
+            os.unlink(entry.path)
+        except FileNotFoundError:
+            pass
@@ -100,7 +100,7 @@ def load_checkpoint():
 
 def run_command(command, cwd, ignore_errors=False):
     try:
-        result = subprocess.run(command, cwd=cwd, shell=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True)
+        result = subprocess.run(command, cwd=cwd, shell=True, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, universal_newlines=True)
         if result.returncode != 0 and not ignore_errors:
             logging.error(f"FAIL: {command}\nSTDERR: {result.stderr.strip()}")
             return False
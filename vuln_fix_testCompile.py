@@ -7,6 +7,8 @@ import logging
 import json
 import time
 import re
+import shutil
+from gcda_utils import iter_gcda_files, purge_gcda_files
 
 # ==========================================
 # CONFIGURATION
@@ -18,6 +20,9 @@ FIX_COMMIT = "f9a70e79391f6d7c2a912d785239ee8effc1922d"
 
 TEST_LIMIT = None 
 
+# One `make fate-list` entry per line
+FATE_TEST_RE = re.compile(r"^\s*(fate-\S+)\s*$", re.MULTILINE)
+
 # ==========================================
 # PATHS
 # ==========================================
@@ -32,6 +37,10 @@ LOG_FILE = os.path.join(LOG_DIR, f"log_{REPO_NAME}_{VULN_COMMIT[:8]}_{FIX_COMMIT
 VULN_CHECKPOINT = os.path.join(CACHE_DIR, f"checkpoint_{REPO_NAME}_{VULN_COMMIT[:8]}.json")
 
 SAMPLES_DIR = os.path.join(BASE_DIR, "ds_projects", "fate-samples")
+CCACHE_DIR = os.path.join(CACHE_DIR, "ccache")
+
+# Compiler for the OpenSSL builds, through ccache when it is installed
+CC = "ccache gcc" if shutil.which("ccache") else "gcc"
 
 # ==========================================
 # SETUP
@@ -53,7 +62,7 @@ def run_command(command, cwd, ignore_errors=False, env=None):
         if env: cmd_env.update(env)
             
         result = subprocess.run(command, cwd=cwd, shell=True, env=cmd_env, 
-                              stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True)
+                              stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, universal_newlines=True)
         if result.returncode != 0 and not ignore_errors:
             logging.error(f"FAIL: {command}\nSTDERR: {result.stderr.strip()}")
             return False
@@ -80,44 +89,20 @@ def clean_repo(cwd):
     run_command("git reset --hard", cwd)
     run_command("git clean -fdx", cwd)
 
-def reset_coverage_counters(cwd):
-    # Delete gcda files recursively
-    subprocess.run("find . -name '*.gcda' -delete", cwd=cwd, shell=True)
-
 def get_covered_files(cwd):
     """
     Scans for .gcda files and maps them back to source .c files.
     Handles standard GCC names, Libtool mangled names, and recursive directories.
     """
     covered = set()
-    for root, dirs, files in os.walk(cwd):
-        for file in files:
-            if file.endswith(".gcda"):
-                # 1. Strip extension
-                name_without_ext = file[:-5] 
-                
-                # 2. Handle Libtool Mangling (e.g., MagickCore..._la-pcl.gcda -> pcl)
-                # We look for the last occurrence of "_la-"
-                if "_la-" in name_without_ext:
-                    real_name = name_without_ext.split("_la-")[-1]
-                else:
-                    real_name = name_without_ext
-                
-                source_name = real_name + ".c"
-                
-                # 3. Handle Directory Logic
-                rel_dir = os.path.relpath(root, cwd)
-                
-                # If gcda is hidden in .libs (common in Autotools), move up one dir
-                if rel_dir.endswith(".libs"):
-                    rel_dir = os.path.dirname(rel_dir)
-                
-                full_path = source_name if rel_dir == "." else os.path.join(rel_dir, source_name)
-                
-                # Normalize path separators
-                full_path = full_path.replace("\\", "/")
-                covered.add(full_path)
-    return list(covered) 
+    for rel, entry in iter_gcda_files(cwd):
+        # If gcda is hidden in .libs (common in Autotools), move up one dir
+        prefix = rel[:-len(".libs/")] if rel.endswith(".libs/") else rel
+        # Strip extension, then Libtool Mangling (e.g., MagickCore..._la-pcl.gcda -> pcl):
+        # keep what follows the last occurrence of "_la-"
+        real_name = entry.name[:-5].rpartition("_la-")[2]
+        covered.add(prefix + real_name + ".c")
+    return covered
 
 def get_git_diff_files(cwd, commit_hash):
     cmd = f"git diff-tree --no-commit-id --name-only -r {commit_hash}"
@@ -127,14 +112,21 @@ def get_git_diff_files(cwd, commit_hash):
 # ==========================================
 # TEST DISCOVERY LOGIC
 # ==========================================
-def get_test_suite(cwd):
+def get_test_suite(cwd, commit):
     suite = []
     repo_lower = REPO_NAME.lower()
 
     if repo_lower == "ffmpeg":
         logging.info("Fetching FATE tests (FFmpeg)...")
-        res = subprocess.run("make fate-list", cwd=cwd, shell=True, stdout=subprocess.PIPE, text=True)
-        tests = [l.strip() for l in res.stdout.split('\n') if l.strip().startswith("fate-")]
+        # `make fate-list` re-parses the whole build system; its output only depends on
+        # the commit, so a resumed phase reads it back instead
+        list_cache = os.path.join(CACHE_DIR, f"fate_list_{commit}.json")
+        tests = load_checkpoint(list_cache).get("tests")
+        if not tests:
+            res = subprocess.run("make fate-list", cwd=cwd, shell=True, stdout=subprocess.PIPE, text=True)
+            tests = FATE_TEST_RE.findall(res.stdout)
+            if res.returncode == 0 and tests:
+                save_checkpoint(list_cache, {"tests": tests})
         if TEST_LIMIT: tests = tests[:TEST_LIMIT]
         for t in tests:
             suite.append({"name": t, "cmd": f"make {t} SAMPLES={SAMPLES_DIR} -j$(nproc)"})
@@ -209,11 +201,12 @@ def configure_and_build(cwd):
 
     elif repo_lower == "openssl":
         if os.path.exists(os.path.join(cwd, "test", "recipes")):
-            run_command("./config -d --coverage", cwd)
+            run_command("./config -d --coverage", cwd, env={"CCACHE_DIR": CCACHE_DIR, "CC": CC})
         else:
-            env = os.environ.copy()
-            env["CFLAGS"] = "-fprofile-arcs -ftest-coverage"
-            run_command("./config -d no-asm no-shared", cwd, env=env)
+            # Pre-1.1.0 Configure ignores a CFLAGS environment variable, the flags must be
+            # passed as arguments (leading '-' options are appended to the compiler flags)
+            run_command("./config -d no-asm no-shared -fprofile-arcs -ftest-coverage", cwd,
+                        env={"CCACHE_DIR": CCACHE_DIR, "CC": CC})
         
         if not run_command("make -j$(nproc)", cwd):
             return run_command("make -j1", cwd)
@@ -266,7 +259,7 @@ def run_vuln_phase(target_files):
     
     if not configure_and_build(PROJECT_DIR): return None
 
-    suite = get_test_suite(PROJECT_DIR)
+    suite = get_test_suite(PROJECT_DIR, VULN_COMMIT)
     results = cached_data.get("results", {}) 
 
     print(f"Running {len(suite)} tests for Vuln Commit...")
@@ -278,7 +271,7 @@ def run_vuln_phase(target_files):
         # Log progress
         print(f"  [Vuln] Test {i+1}/{len(suite)}: {t_name}")
         
-        reset_coverage_counters(PROJECT_DIR)
+        purge_gcda_files(PROJECT_DIR)
         run_command(test['cmd'], PROJECT_DIR, ignore_errors=True)
         
         covered_list = get_covered_files(PROJECT_DIR)
@@ -308,7 +301,7 @@ def run_fix_phase(vuln_results, target_files):
         writer.writerow(headers)
         f_csv.flush()
 
-    suite = get_test_suite(PROJECT_DIR)
+    suite = get_test_suite(PROJECT_DIR, FIX_COMMIT)
     print(f"Running {len(suite)} tests for Fix Commit...")
 
     processed_tests = set()
@@ -319,13 +312,15 @@ def run_fix_phase(vuln_results, target_files):
         
         print(f"  [Fix] Test {i+1}/{len(suite)}: {t_name}")
 
-        reset_coverage_counters(PROJECT_DIR)
+        purge_gcda_files(PROJECT_DIR)
         run_command(test['cmd'], PROJECT_DIR, ignore_errors=True)
         
         covered_list = get_covered_files(PROJECT_DIR)
         
+        # Look-ups below are set membership tests, not list scans
+        v_files = set(vuln_results.get(t_name, ()))
         for target in target_files:
-            v_covered = (t_name in vuln_results) and (target in vuln_results[t_name])
+            v_covered = target in v_files
             f_covered = target in covered_list
 
             if v_covered or f_covered: